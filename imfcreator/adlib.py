@@ -2,6 +2,8 @@
 
 This module contains fields and classes representing Adlib register values and instruments.
 """
+import typing as _typing
+
 OPL_CHANNELS = 9
 
 # OPERATORS
@@ -73,6 +75,17 @@ PERCUSSION_MODE_TOM_TOM_MASK = 0b00000100
 PERCUSSION_MODE_CYMBAL_MASK = 0b00000010
 PERCUSSION_MODE_HI_HAT_MASK = 0b00000001
 
+# Register writes that reset an OPL chip before playing a song.
+RESET_REGISTERS = [
+    (0x01, 0x20),  # enable Waveform Select
+    (COMP_SINE_WAVE_MODE_MSG, 0x40),  # turn off CSW mode
+    (DRUM_MSG, 0x00),  # set vibrato / tremolo depth to low, set melodic mode
+] + [command for channel in range(OPL_CHANNELS) for command in [
+    (VOLUME_MSG | MODULATORS[channel], 0x3f),  # turn off volume
+    (VOLUME_MSG | CARRIERS[channel], 0x3f),  # turn off volume
+    (BLOCK_MSG | channel, 0),  # KEY-OFF
+]]
+
 
 class AdlibInstrument(object):
     """Represents an Adlib instrument.
@@ -101,9 +114,11 @@ class AdlibInstrument(object):
         self.carrier = [AdlibOperator() for _ in range(num_voices)]
         self.feedback = [0] * num_voices  # 8-bit
         self.note_offset = [0] * num_voices  # 16-bit, signed
+        # Cached instrument registers by (channel, voice).  Entries start with the values they were built from.
+        self._instrument_regs_cache = {}
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str({k: v for k, v in self.__dict__.items() if not k.startswith("_")})
 
     def get_regs(self, channel: int, voice: int = 0):
         mod_op = MODULATORS[channel]
@@ -122,6 +137,22 @@ class AdlibInstrument(object):
             (FEEDBACK_MSG | channel, self.feedback[voice]),  # | 0x30),
         ]
 
+    def get_instrument_regs(self, channel: int, voice: int = 0) -> _typing.Tuple[_typing.Tuple[int, int], ...]:
+        """Returns the registers from `get_regs` without the volume registers.
+
+        The result is cached per channel and voice.  It is rebuilt when the voice's operators or feedback change.
+        """
+        modulator = self.modulator[voice]
+        carrier = self.carrier[voice]
+        feedback = self.feedback[voice]
+        entry = self._instrument_regs_cache.get((channel, voice))
+        if (entry is None or entry[0] is not modulator or entry[1] != modulator.generation
+                or entry[2] is not carrier or entry[3] != carrier.generation or entry[4] != feedback):
+            regs = tuple(reg for reg in self.get_regs(channel, voice) if (reg[0] & 0xf0) != VOLUME_MSG)
+            entry = (modulator, modulator.generation, carrier, carrier.generation, feedback, regs)
+            self._instrument_regs_cache[(channel, voice)] = entry
+        return entry[5]
+
     def registers_match(self, other: "AdlibInstrument"):
         if self.num_voices != other.num_voices:
             return False
@@ -161,7 +192,13 @@ def _create_bit_property(var_name: str, bits: int, shift: int):
 
 
 class AdlibOperator(object):  # MUST inherit from object for properties to work.
-    """Represents an adlib operator's register values."""
+    """Represents an adlib operator's register values.
+
+    `generation` increases whenever a register value is set so that cached register data can be checked.
+    """
+
+    _REGISTERS = ("tvskm", "ksl_output", "attack_decay", "sustain_release", "waveform_select")
+    _REGISTER_SET = frozenset(_REGISTERS)
 
     def __init__(self, tvskm: int = 0, ksl_output: int = 0, attack_decay: int = 0, sustain_release: int = 0,
                  waveform_select: int = 0):
@@ -172,6 +209,11 @@ class AdlibOperator(object):  # MUST inherit from object for properties to work.
         self.waveform_select = 0  # -----www = waveform select
         self.set_regs(tvskm, ksl_output, attack_decay, sustain_release, waveform_select)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in AdlibOperator._REGISTER_SET:
+            object.__setattr__(self, "generation", self.__dict__.get("generation", 0) + 1)
+
     # Bit-level properties.
     tremolo = _create_bit_property("tvskm", 1, 7)
     vibrato = _create_bit_property("tvskm", 1, 6)
@@ -208,11 +250,16 @@ class AdlibOperator(object):  # MUST inherit from object for properties to work.
             count += 1
         return count
 
+    @property
+    def registers(self) -> _typing.Tuple[int, int, int, int, int]:
+        """The operator's register values."""
+        return (self.tvskm, self.ksl_output, self.attack_decay, self.sustain_release, self.waveform_select)
+
     def __repr__(self):
-        return str(self.__dict__)
+        return str({name: getattr(self, name) for name in AdlibOperator._REGISTERS})
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return self.registers == other.registers
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -2,6 +2,9 @@
 
 This loads and stores instruments that the conversion process uses.
 
+Instruments are stored in an `InstrumentRegistry`.  The module functions use `default_registry`.  Other registries can
+be created to keep several banks loaded at once and passed to `AdlibSongFile.convert_from`.
+
 Instruments are added using `add`, `add_file`, or `update`.
 They are retrieved using `get`.
 
@@ -10,118 +13,201 @@ Bank numbers should be MSB << 7 + LSB since the MSB and LSB values are limited t
 Use `get_name` to get the instrument name
 """
 import logging as _logging
+import threading as _threading
 import typing as _typing
 from imfcreator.adlib import AdlibInstrument as _AdlibInstrument
 from imfcreator.plugins import InstrumentId, InstrumentType, InstrumentFile as _InstrumentFile, \
     MidiSongFile as _MidiSongFile
 
 
-# The key is (inst_type, bank, program), value is the Adlib instrument.
-_INSTRUMENTS = {}  # type: _typing.Dict[InstrumentId, _AdlibInstrument]
+class InstrumentRegistry:
+    """Loads and stores instruments for the conversion process.
 
-enable_gm2_drum_note_mapping = False
-# List of searches that gave no results.
-_WARNINGS = []
+    Registries can be shared by conversions running in several threads.
+    """
 
+    def __init__(self, enable_gm2_drum_note_mapping: bool = False):
+        self.enable_gm2_drum_note_mapping = enable_gm2_drum_note_mapping
+        """When true, missing GM2 percussion instruments are replaced by similar GM instruments."""
+        self._lock = _threading.RLock()
+        # The key is (inst_type, bank, program), value is the Adlib instrument.
+        self._instruments = {}  # type: _typing.Dict[InstrumentId, _AdlibInstrument]
+        # Instruments returned by `get`, including bank 0 and GM2 drum note map fallbacks.  Cleared when instruments
+        # change.  The key is (inst_type, bank, program, enable_gm2_drum_note_mapping), value is the Adlib instrument
+        # or None.
+        self._resolved_instruments = {}  # type: _typing.Dict[tuple, _AdlibInstrument]
+        # Searches that gave no results.
+        self._warnings = set()  # type: _typing.Set[InstrumentId]
+
+    def add(self, inst_type: InstrumentType, bank: int, program: int, adlib_instrument: _AdlibInstrument):
+        """Add an instrument to the registry.
+
+        :param inst_type: The instrument type.  MELODIC or PERCUSSION.
+        :param bank: The instrument bank.
+        :param program: The program or patch number.
+        :param adlib_instrument: The Adlib instrument.
+        :return: None
+        """
+        key = (inst_type, bank, program)
+        _validate_args(inst_type, bank, program)
+        with self._lock:
+            if key in self._instruments:
+                _logging.info(f"Replacing instrument {key}")
+            self._instruments[InstrumentId(*key)] = adlib_instrument
+            self._resolved_instruments.clear()
+
+    def update(self, instruments: _typing.Dict[InstrumentId, _AdlibInstrument], bank_offset: int = 0):
+        """Updates the instrument dictionary with another instrument dictionary.
+
+        :param instruments: The new instrument dictionary.
+        :param bank_offset: Offset by which instrument banks are adjusted.
+        """
+        if instruments:
+            with self._lock:
+                for key, instrument in instruments.items():
+                    self.add(key.instrument_type, key.bank + bank_offset, key.program, instrument)
+                _logging.info(f"Total instruments loaded: {self.count()}")
+
+    def add_file(self, f, bank_offset: int = 0):
+        """Adds all of the instruments in a file.
+
+        :param f: A filename or file object.
+        :param bank_offset: Offset by which instrument banks are adjusted.
+        """
+        try:
+            instrument_file = _InstrumentFile.load_file(f)
+        except ValueError:
+            instrument_file = _MidiSongFile.load_file(f)
+        self.update(instrument_file.instruments, bank_offset)
+
+    def clear(self):
+        """Clears the instruments from the registry."""
+        with self._lock:
+            self._instruments.clear()
+            self._resolved_instruments.clear()
+
+    def count(self) -> int:
+        """Returns the instrument count."""
+        return len(self._instruments)
+
+    def get(self, inst_type: InstrumentType, bank: int, program: int) -> _AdlibInstrument:
+        """Returns the Adlib instrument based on the given type, program, and bank.
+
+        :param inst_type: The instrument type.  MELODIC or PERCUSSION.
+        :param bank: The instrument bank.
+        :param program: The program or patch number.
+        :return: An Adlib instrument if a match is found; otherwise None.
+        """
+        resolved_key = (inst_type, bank, program, self.enable_gm2_drum_note_mapping)
+        # Cached instruments can be read without the lock since entries are only added or cleared, never changed.
+        try:
+            return self._resolved_instruments[resolved_key]
+        except KeyError:
+            pass
+        with self._lock:
+            instrument = self._resolve(inst_type, bank, program, resolved_key[3])
+            self._resolved_instruments[resolved_key] = instrument
+        return instrument
+
+    def _resolve(self, inst_type: InstrumentType, bank: int, program: int,
+                 enable_gm2_drum_note_mapping: bool) -> _AdlibInstrument:
+        """Finds the Adlib instrument for `get`, logging a warning the first time a search gives no result."""
+        _validate_args(inst_type, bank, program)
+        original_bank = bank
+        key = InstrumentId(inst_type, bank, program)
+        if bank > 0:
+            if key not in self._instruments:
+                if key not in self._warnings:
+                    self._warnings.add(key)
+                    _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, "
+                                     f"program {program}.  Trying bank 0.")
+                bank = 0
+                key = InstrumentId(inst_type, 0, program)
+        instrument = self._instruments.get(key)
+        if instrument is None:
+            # Try GM2 drum mapping.
+            if inst_type == InstrumentType.PERCUSSION and \
+                    enable_gm2_drum_note_mapping and program in _GM2_DRUM_NOTE_MAPPING:
+                if key not in self._warnings:
+                    self._warnings.add(key)
+                    _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, "
+                                     f"program {program}.  Using GM2 drum note map.")
+                return self._resolve(inst_type, original_bank, _GM2_DRUM_NOTE_MAPPING[program],
+                                     enable_gm2_drum_note_mapping)
+            if key not in self._warnings:
+                self._warnings.add(key)
+                _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, program {program}")
+        return instrument
+
+    def has(self, inst_type: InstrumentType, bank: int, program: int) -> bool:
+        """Tests whether an Adlib instrument has been assigned based on the given type, program, and bank.
+
+        :param inst_type: The instrument type.  MELODIC or PERCUSSION.
+        :param bank: The instrument bank.
+        :param program: The program or patch number.
+        :return: A boolean.
+        """
+        _validate_args(inst_type, bank, program)
+        key = (inst_type, bank, program)
+        return key in self._instruments
 
-def add(inst_type: InstrumentType, bank: int, program: int, adlib_instrument: _AdlibInstrument):
-    """Add an instrument to the instrument manager.
 
-    :param inst_type: The instrument type.  MELODIC or PERCUSSION.
-    :param bank: The instrument bank.
-    :param program: The program or patch number.
-    :param adlib_instrument: The Adlib instrument.
-    :return: None
+enable_gm2_drum_note_mapping = False
+"""When true, `default_registry` replaces missing GM2 percussion instruments with similar GM instruments."""
+
+
+class _DefaultInstrumentRegistry(InstrumentRegistry):
+    """The registry used by the module functions.  Its GM2 drum note mapping setting is the module's
+    `enable_gm2_drum_note_mapping`.
     """
-    key = (inst_type, bank, program)
-    _validate_args(inst_type, bank, program)
-    if key in _INSTRUMENTS:
-        _logging.info(f"Replacing instrument {key}")
-    _INSTRUMENTS[InstrumentId(*key)] = adlib_instrument
 
+    @property
+    def enable_gm2_drum_note_mapping(self) -> bool:
+        return enable_gm2_drum_note_mapping
 
-def update(instruments: _typing.Dict[InstrumentId, _AdlibInstrument], bank_offset: int = 0):
-    """Updates the instrument dictionary with another instrument dictionary.
+    @enable_gm2_drum_note_mapping.setter
+    def enable_gm2_drum_note_mapping(self, value: bool):
+        global enable_gm2_drum_note_mapping
+        enable_gm2_drum_note_mapping = value
 
-    :param instruments: The new instrument dictionary.
-    :param bank_offset: Offset by which instrument banks are adjusted.
-    """
-    # _INSTRUMENTS.update(instruments)
-    if instruments:
-        for key, instrument in instruments.items():
-            add(key.instrument_type, key.bank + bank_offset, key.program, instrument)
-        _logging.info(f"Total instruments loaded: {count()}")
 
+default_registry = _DefaultInstrumentRegistry()  # type: InstrumentRegistry
+"""The registry used by the module functions and by conversions that aren't given a registry."""
 
-def add_file(f, bank_offset: int = 0):
-    """Adds all of the instruments in a file.
 
-    :param f: A filename or file object.
-    :param bank_offset: Offset by which instrument banks are adjusted.
-    """
-    try:
-        instrument_file = _InstrumentFile.load_file(f)
-    except ValueError:
-        instrument_file = _MidiSongFile.load_file(f)
-    update(instrument_file.instruments, bank_offset)
+def add(inst_type: InstrumentType, bank: int, program: int, adlib_instrument: _AdlibInstrument):
+    """Add an instrument to the default registry.  See `InstrumentRegistry.add`."""
+    default_registry.add(inst_type, bank, program, adlib_instrument)
+
+
+def update(instruments: _typing.Dict[InstrumentId, _AdlibInstrument], bank_offset: int = 0):
+    """Updates the default registry with an instrument dictionary.  See `InstrumentRegistry.update`."""
+    default_registry.update(instruments, bank_offset)
+
+
+def add_file(f, bank_offset: int = 0):
+    """Adds all of the instruments in a file to the default registry.  See `InstrumentRegistry.add_file`."""
+    default_registry.add_file(f, bank_offset)
 
 
 def clear():
-    """Clears the instruments from the instrument manager."""
-    _INSTRUMENTS.clear()
+    """Clears the instruments from the default registry."""
+    default_registry.clear()
 
 
 def count() -> int:
-    """Returns the instrument count."""
-    return len(_INSTRUMENTS)
+    """Returns the instrument count of the default registry."""
+    return default_registry.count()
 
 
 def get(inst_type: InstrumentType, bank: int, program: int) -> _AdlibInstrument:
-    """Returns the Adlib instrument based on the given type, program, and bank.
-
-    :param inst_type: The instrument type.  MELODIC or PERCUSSION.
-    :param bank: The instrument bank.
-    :param program: The program or patch number.
-    :return: An Adlib instrument if a match is found; otherwise None.
-    """
-    _validate_args(inst_type, bank, program)
-    original_bank = bank
-    key = InstrumentId(inst_type, bank, program)
-    if bank > 0:
-        if key not in _INSTRUMENTS:
-            if key not in _WARNINGS:
-                _WARNINGS.append(key)
-                _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, "
-                                 f"program {program}.  Trying bank 0.")
-            bank = 0
-            key = InstrumentId(inst_type, 0, program)
-    instrument = _INSTRUMENTS.get(key)
-    if instrument is None:
-        # Try GM2 drum mapping.
-        if inst_type == InstrumentType.PERCUSSION and \
-                enable_gm2_drum_note_mapping and program in _GM2_DRUM_NOTE_MAPPING:
-            if key not in _WARNINGS:
-                _WARNINGS.append(key)
-                _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, "
-                                 f"program {program}.  Using GM2 drum note map.")
-            return get(inst_type, original_bank, _GM2_DRUM_NOTE_MAPPING[program])
-        if key not in _WARNINGS:
-            _WARNINGS.append(key)
-            _logging.warning(f"Could not find {inst_type.name} instrument: bank {bank:#06x}, program {program}")
-    return instrument
+    """Returns an Adlib instrument from the default registry.  See `InstrumentRegistry.get`."""
+    return default_registry.get(inst_type, bank, program)
 
 
 def has(inst_type: InstrumentType, bank: int, program: int) -> bool:
-    """Tests whether an Adlib instrument has been assigned based on the given type, program, and bank.
-
-    :param inst_type: The instrument type.  MELODIC or PERCUSSION.
-    :param bank: The instrument bank.
-    :param program: The program or patch number.
-    :return: A boolean.
-    """
-    _validate_args(inst_type, bank, program)
-    key = (inst_type, bank, program)
-    return key in _INSTRUMENTS
+    """Tests whether the default registry has an Adlib instrument.  See `InstrumentRegistry.has`."""
+    return default_registry.has(inst_type, bank, program)
 
 
 def _validate_args(inst_type: InstrumentType, bank: int, program: int):
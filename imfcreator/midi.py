@@ -1,4 +1,6 @@
+import array as _array
 import logging as _logging
+import typing as _typing
 from enum import IntEnum
 from functools import total_ordering
 
@@ -27,34 +29,52 @@ class SongEvent:
     This is just a MIDI event and song readers should convert their file format's events to use this.
 
     The data dictionary will vary per event_type.  See EventType.
+
+    Event times are stored as integer ticks from the start of the song.  `division` is the number of ticks per beat
+    and `time` gives the time in beats.  All of the events in a song should share the same division.
+
+    The sort key is computed once when the event is created, so the ticks, track, type and channel of an event should
+    not be changed afterward.  The index can be reassigned and updates the sort key.
     """
+    __slots__ = ("_index", "track", "ticks", "division", "type", "data", "channel", "sort_key")
 
-    def __init__(self, index: int, track: int, time: float, event_type: "EventType", data: dict = None,
-                 channel: int = None):
+    def __init__(self, index: int, track: int, ticks: int, event_type: "EventType", data: dict = None,
+                 channel: int = None, division: int = 1):
         """Creates a song event.
 
         :param index: The index of the event in the MIDI track (used when sorting).
         :param track: The track number for the event.
-        :param time: The time of the event from the start of the song, in beats.
+        :param ticks: The time of the event from the start of the song, in ticks.
         :param event_type: The event type.
         :param data: A data dictionary for the event.  Contents will vary per event_type.
         :param channel: The event channel.  Must be None for sysex and meta event types and an integer for all others.
+        :param division: The number of ticks per beat.
         """
         # Validate arguments.
-        if event_type in [EventType.F0_SYSEX, EventType.F7_SYSEX, EventType.META]:
+        type_order = _EVENT_TYPE_ORDER.get(event_type)
+        if type_order is None:
+            raise ValueError(f"Unknown event type: {event_type}")
+        if event_type in _NON_CHANNEL_EVENT_TYPES:
             if channel is not None:
                 raise ValueError(f"Channel must be None for {str(event_type)} events.")
-        elif channel is None or type(channel) is not int:
+            # Non-channel events are "less than" channel events.
+            sort_channel = -1
+        elif type(channel) is not int:
             raise ValueError(f"Channel must be an integer for {str(event_type)} events.")
+        else:
+            sort_channel = channel
         if event_type == EventType.META and "meta_type" not in data:
             raise ValueError(f"{str(event_type)} events must have a 'meta_type' data entry.")
         # Set fields.
-        self.index = index
+        self._index = index
         self.track = track
-        self.time = time
+        self.ticks = ticks
+        self.division = division
         self.type = event_type
         self.data = data
         self.channel = channel  # _typing.Optional[int]
+        self.sort_key = (ticks, type_order, sort_channel, track, index)
+        """A key for sorting events: ticks, event type priority, channel, track, then index."""
 
     def __repr__(self):
         text = f"{self.time:0.3f}: {str(self.type)} - #{self.index}"
@@ -70,40 +90,26 @@ class SongEvent:
     def __setitem__(self, key, value):
         self.data[key] = value
 
+    @property
+    def time(self) -> float:
+        """The time of the event from the start of the song, in beats."""
+        return self.ticks / self.division
+
+    @property
+    def index(self) -> int:
+        """The index of the event in the MIDI track (used when sorting)."""
+        return self._index
+
+    @index.setter
+    def index(self, value: int):
+        self._index = value
+        self.sort_key = self.sort_key[:4] + (value,)
+
     def __eq__(self, other: "SongEvent"):
-        if self.time != other.time:
-            return False
-        if _EVENT_TYPE_ORDER[self.type] != _EVENT_TYPE_ORDER[other.type]:
-            return False
-        if self.channel != other.channel:
-            return False
-        if self.track != other.track:
-            return False
-        if self.index != other.index:
-            return False
-        return True
+        return self.sort_key == other.sort_key
 
     def __lt__(self, other: "SongEvent"):
-        if self.time < other.time:
-            return True
-        elif self.time > other.time:
-            return False
-        if _EVENT_TYPE_ORDER[self.type] < _EVENT_TYPE_ORDER[other.type]:
-            return True
-        elif _EVENT_TYPE_ORDER[self.type] > _EVENT_TYPE_ORDER[other.type]:
-            return False
-        # Non-channel events are "less than" channel events.
-        self_channel = -1 if self.channel is None else self.channel
-        other_channel = -1 if other.channel is None else other.channel
-        if self_channel < other_channel:
-            return True
-        elif self_channel > other_channel:
-            return False
-        if self.track < other.track:
-            return True
-        elif self.track > other.track:
-            return False
-        return self.index < other.index
+        return self.sort_key < other.sort_key
 
 
 class EventType(IntEnum):
@@ -146,6 +152,8 @@ _EVENT_TYPE_ORDER = {
     EventType.META: 0,  # Tempo changes, for example, should be high priority.
 }
 
+_NON_CHANNEL_EVENT_TYPES = frozenset([EventType.F0_SYSEX, EventType.F7_SYSEX, EventType.META])
+
 
 class MetaType(IntEnum):
     """Song meta event types.
@@ -306,3 +314,132 @@ class ControllerType(IntEnum):
             pseudo_member._value_ = value
             pseudo_member = cls._value2member_map_.setdefault(value, pseudo_member)
         return pseudo_member
+
+
+# Lookup tables indexed by the raw byte values so that decoders don't need to construct enum members per event.
+CONTROLLER_TYPES = tuple(ControllerType._create_pseudo_member_(value) for value in range(128))
+"""ControllerType members indexed by controller number.  Undefined controllers map to pseudo-members."""
+META_TYPES = tuple(MetaType._value2member_map_.get(value) for value in range(256))
+"""MetaType members indexed by meta type number.  Unknown meta types are None."""
+_EVENT_TYPES = tuple(EventType._value2member_map_.get(value) for value in range(256))
+# Data keys that are stored in the data1 and data2 columns of a SongEventTable, by event type.
+_COLUMN_DATA_KEYS = {
+    EventType.NOTE_OFF: ("note", "velocity"),
+    EventType.NOTE_ON: ("note", "velocity"),
+    EventType.POLYPHONIC_KEY_PRESSURE: ("note", "pressure"),
+    EventType.CONTROLLER_CHANGE: ("controller", "value"),
+    EventType.PROGRAM_CHANGE: ("program",),
+    EventType.CHANNEL_KEY_PRESSURE: ("pressure",),
+}
+
+
+def _is_column_value(value) -> bool:
+    """Returns whether an event data value can be stored in a SongEventTable data column."""
+    return type(value) in (int, ControllerType) and 0 <= value <= 0xff
+
+
+class SongEventTable:
+    """A compact, column-oriented alternative to a list of song events.
+
+    Event fields are stored in parallel typed arrays.  Note, controller, program, and pressure data is stored in the
+    data1 and data2 columns.  Data that doesn't fit in them, such as meta, sysex, and pitch bend data, is stored in a
+    side table keyed by row.
+
+    Indexing and iterating return SongEvent rows that are created on demand.  They are copies, so changes made to
+    them are not stored in the table.
+
+    All events in the table share the same division, the number of ticks per beat.
+    """
+
+    def __init__(self, events: _typing.Iterable[SongEvent] = None, division: int = 1):
+        self.division = division
+        self.ticks = _array.array("q")
+        self.tracks = _array.array("H")
+        self.indices = _array.array("i")
+        self.types = _array.array("B")
+        self.channels = _array.array("b")  # -1 for non-channel events.
+        self.data1 = _array.array("B")
+        self.data2 = _array.array("B")
+        self._other_data = {}  # type: _typing.Dict[int, _typing.Optional[dict]]  # row, data
+        if events is not None:
+            self.extend(events)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._get_event(r) for r in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("SongEventTable index out of range")
+        return self._get_event(row)
+
+    def __iter__(self) -> _typing.Iterator[SongEvent]:
+        for row in range(len(self)):
+            yield self._get_event(row)
+
+    def _get_event(self, row: int) -> SongEvent:
+        event_type = _EVENT_TYPES[self.types[row]]
+        channel = self.channels[row]
+        if row in self._other_data:
+            data = self._other_data[row]
+        else:
+            keys = _COLUMN_DATA_KEYS[event_type]
+            data = {keys[0]: self.data1[row]}
+            if len(keys) == 2:
+                data[keys[1]] = self.data2[row]
+            if event_type == EventType.CONTROLLER_CHANGE:
+                data["controller"] = CONTROLLER_TYPES[data["controller"]]
+        return SongEvent(self.indices[row], self.tracks[row], self.ticks[row], event_type, data,
+                         None if channel < 0 else channel, self.division)
+
+    def add(self, index: int, track: int, ticks: int, event_type: EventType, data: dict = None,
+            channel: int = None):
+        """Adds an event to the table.  The arguments are the same as those of SongEvent, but use the table's
+        division.
+        """
+        row = len(self.types)
+        self.ticks.append(ticks)
+        self.tracks.append(track)
+        self.indices.append(index)
+        self.types.append(event_type)
+        self.channels.append(-1 if channel is None else channel)
+        keys = _COLUMN_DATA_KEYS.get(event_type)
+        if keys and data and len(data) == len(keys) and all(_is_column_value(data.get(key)) for key in keys):
+            self.data1.append(data[keys[0]])
+            self.data2.append(data[keys[1]] if len(keys) == 2 else 0)
+        else:
+            self.data1.append(0)
+            self.data2.append(0)
+            self._other_data[row] = data
+
+    def append(self, song_event: SongEvent):
+        """Adds a song event to the table."""
+        if song_event.division != self.division:
+            raise ValueError(f"Event division {song_event.division} does not match the table's {self.division}.")
+        self.add(song_event.index, song_event.track, song_event.ticks, song_event.type, song_event.data,
+                 song_event.channel)
+
+    def extend(self, events: _typing.Iterable[SongEvent]):
+        """Adds song events to the table."""
+        for song_event in events:
+            self.append(song_event)
+
+    def sort(self):
+        """Sorts the events into chronological order in place and reassigns event indices.
+
+        The order is the same as sorting SongEvent objects by `SongEvent.sort_key`.
+        """
+        ticks, types, channels, tracks, indices = self.ticks, self.types, self.channels, self.tracks, self.indices
+        type_order = [_EVENT_TYPE_ORDER.get(event_type, 0) for event_type in range(256)]
+        order = sorted(range(len(self)),
+                       key=lambda r: (ticks[r], type_order[types[r]], channels[r], tracks[r], indices[r]))
+        for name in ("ticks", "tracks", "types", "channels", "data1", "data2"):
+            column = getattr(self, name)
+            setattr(self, name, _array.array(column.typecode, [column[r] for r in order]))
+        self.indices = _array.array(self.indices.typecode, range(len(order)))
+        other_data = self._other_data
+        self._other_data = {new_row: other_data[old_row] for new_row, old_row in enumerate(order)
+                            if old_row in other_data}
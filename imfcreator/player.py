@@ -1,8 +1,11 @@
 """Contains classes for playing Adlib music."""
+import ctypes
 import pyaudio
 import pyopl
-import sys
+import threading
 import imfcreator.utils as utils
+from bisect import bisect_left
+from collections import deque
 from enum import IntEnum, auto
 from os import SEEK_SET, SEEK_CUR, SEEK_END
 from imfcreator.adlib import *
@@ -18,27 +21,56 @@ class PlayerState(IntEnum):
 
 
 class AdlibPlayer:
-    """A streaming IMF music player."""
+    """A streaming IMF music player.
+
+    By default, samples are rendered in the PyAudio callback.  When `lookahead` is set, a background thread renders up
+    to that many buffers ahead and the callback only hands them to PyAudio, so slow work on other threads doesn't
+    cause dropouts.
+    """
     FREQUENCY = 44100
     SAMPLE_SIZE = 2  # 16-bit
     CHANNELS = 2  # stereo
     BUFFER_SAMPLE_COUNT = 512  # Max allowed: 512
+    BUFFER_COUNT = 4  # The minimum number of output buffers the player takes turns filling.
+    _MINIMUM_SAMPLE_COUNT = 2  # The fewest samples the OPL synth renders at once.
+    _KEY_REGISTERS = [BLOCK_MSG | channel for channel in range(OPL_CHANNELS)] + [DRUM_MSG]  # Key on bits live here.
+
+    def __init__(self, freq: int = FREQUENCY, ticks_per_second: int = 700, lookahead: int = 0):
+        """Initializes PyAudio and the PyOPL synth.
 
-    def __init__(self, freq: int = FREQUENCY, ticks_per_second: int = 700):
-        """Initializes PyAudio and the PyOPL synth."""
+        :param freq: The playback rate.
+        :param ticks_per_second: The song speed.
+        :param lookahead: The number of buffers a background thread renders ahead of playback.  0 renders in the
+            PyAudio callback.
+        """
+        if lookahead < 0:
+            raise ValueError("Invalid lookahead value.  Must be 0 or greater.")
         self._freq = freq
         self.ticks_per_second = ticks_per_second
+        self.lookahead = lookahead
+        self.underrun_count = 0
+        """The number of times the callback had no rendered buffer ready and played silence."""
         # Prepare PyAudio
         self._audio = pyaudio.PyAudio()
         # Prepare buffers.
-        self._data = bytearray(AdlibPlayer.BUFFER_SAMPLE_COUNT * AdlibPlayer.SAMPLE_SIZE * AdlibPlayer.CHANNELS)
-        if sys.version_info[0] < 3:
-            # noinspection PyUnresolvedReferences
-            self._buffer = buffer(self._data)  # Wraps self.data. Used by PyAudio.
-        else:
-            # Since Python 3 doesn't have buffer() and PyAudio doesn't support memoryview.
-            # noinspection PyShadowingNames
-            AdlibPlayer._buffer = property(lambda self: bytes(self._data))
+        # PyAudio only accepts read-only buffers, which rules out bytearray and memoryview.  ctypes arrays are accepted
+        # and can be written to, so they are returned to PyAudio without being copied.
+        buffer_size = AdlibPlayer.BUFFER_SAMPLE_COUNT * AdlibPlayer.SAMPLE_SIZE * AdlibPlayer.CHANNELS
+        # Lookahead buffers are in use while queued, while being rendered, and while PyAudio reads them.
+        buffer_count = max(AdlibPlayer.BUFFER_COUNT, lookahead + 2)
+        self._buffers = [(ctypes.c_char * buffer_size)() for _ in range(buffer_count)]
+        self._views = [memoryview(b).cast("B") for b in self._buffers]  # Slices of these are filled by the OPL synth.
+        self._buffer_index = 0
+        # Lookahead rendering.  The deques are only appended to and popped from, which is thread-safe without locks.
+        self._silence = (ctypes.c_char * buffer_size)()  # Played when no rendered buffer is ready.
+        self._free_buffers = deque(range(buffer_count))  # Buffer indices that can be rendered to.
+        self._ready_buffers = deque()  # (buffer index, sample count) pairs in play order.  See _render_buffer.
+        self._played_buffer = None  # The buffer index last given to PyAudio.
+        self._synth_lock = threading.RLock()  # Held while the song position and OPL synth are used.
+        self._render_event = threading.Event()  # Set to wake the render thread.
+        self._render_thread = None  # type: Optional[threading.Thread]
+        self._render_stopped = False  # Set when the render thread reaches the end of the song.
+        self._closing = False
 
         # Prepare stream attribute and opl player.
         self._stream = None  # type: Optional[pyaudio.Stream]  # Created later.
@@ -46,9 +78,12 @@ class AdlibPlayer:
         # reset
         # self._commands = []
         self._song = None
+        # Register -> (command positions, values) of each write to the register, in song order.  See _build_seek_index.
+        self._register_writes = {}
         # rewind
         self._position = 0
-        self._delay = 0
+        self._delay = 0  # The number of samples to render before processing the next command.
+        self._delay_remainder = 0  # The fraction of a sample left over from delays, in 1/ticks_per_second units.
         self.repeat = False
         # self.ignoreregs = []
         self.onstatechanged = Signal(state=PlayerState)
@@ -67,11 +102,36 @@ class AdlibPlayer:
             stream_callback=self._callback)
 
     def set_song(self, song):
-        self._song = song
-        self.rewind()
+        with self._synth_lock:
+            self._song = song
+            self._build_seek_index()
+            self.rewind()
+
+    def _build_seek_index(self):
+        """Indexes the song's writes to each register so that seeking can look up register values instead of
+        replaying commands.  Registers holding key on bits are ordered last so that notes start with their final
+        settings.
+        """
+        register_writes = {}
+        if self._song is not None:
+            # noinspection PyProtectedMember
+            for position, (reg, value, _) in enumerate(self._song._commands):
+                writes = register_writes.get(reg)
+                if writes is None:
+                    writes = register_writes[reg] = ([], [])
+                writes[0].append(position)
+                writes[1].append(value)
+        key_registers = [reg for reg in AdlibPlayer._KEY_REGISTERS if reg in register_writes]
+        self._register_writes = {reg: writes for reg, writes in register_writes.items() if reg not in key_registers}
+        self._register_writes.update((reg, register_writes[reg]) for reg in key_registers)
 
     def seek(self, offset: int, whence: int = 0):
         """Moves the play position to the command at the given offset."""
+        with self._synth_lock:
+            self._discard_rendered_buffers()
+            self._seek(offset, whence)
+
+    def _seek(self, offset: int, whence: int):
         if whence == SEEK_SET:
             new_position = offset
         elif whence == SEEK_CUR:
@@ -83,14 +143,17 @@ class AdlibPlayer:
         new_position = utils.clamp(new_position, 0, self._song.command_count - 1)
         if self._position == new_position:
             return
-        # Process commands between old and new positions. If the new position is before the old,
-        # rewind and start from there.
-        if new_position < self._position:
-            self.rewind()
-        for c in range(self._position, new_position):
-            self._process_command()
-        # Clear the delay accumulator after processing commands.
-        self._delay = 0
+        # Reset the chip, then write the value each register has at the new position.
+        # Registers the song hasn't written yet get their reset value, or 0 if reset doesn't write them.
+        self._rewind()
+        reset_values = dict(RESET_REGISTERS)
+        for reg, (positions, values) in self._register_writes.items():
+            index = bisect_left(positions, new_position)
+            if index:
+                self.writereg(reg, values[index - 1])
+            elif reg not in reset_values:
+                self.writereg(reg, 0)
+        self._position = new_position
 
     def tell(self):
         """Returns the current command number."""
@@ -100,20 +163,33 @@ class AdlibPlayer:
         """Resets OPL player values back to defaults."""
         # for reg in range(255):
         #     self.writereg(reg, 0)
-        self.writereg(0x01, 0x20)  # enable Waveform Select
-        self.writereg(0x08, 0x40)  # turn off CSW mode
-        self.writereg(0xBD, 0x00)  # set vibrato / tremolo depth to low, set melodic mode
-        for i in range(9):
-            self.writereg(0x40 | MODULATORS[i], 0x3f)  # turn off volume
-            self.writereg(0x40 | CARRIERS[i], 0x3f)  # turn off volume
-            self.writereg(0xb0 | i, 0)  # KEY-OFF
+        for reg, value in RESET_REGISTERS:
+            self.writereg(reg, value)
 
     def rewind(self):
         """Sets the playback position back to the beginning."""
+        with self._synth_lock:
+            self._discard_rendered_buffers()
+            self._rewind()
+
+    def _rewind(self):
         self._position = 0
         self._delay = 0
+        self._delay_remainder = 0
         self.reset_opl()
 
+    def _discard_rendered_buffers(self):
+        """Discards buffers rendered ahead of the play position and lets the render thread continue."""
+        while self._ready_buffers:
+            try:
+                index, _ = self._ready_buffers.popleft()
+            except IndexError:
+                # The callback took the last one.
+                break
+            self._free_buffers.append(index)
+        self._render_stopped = False
+        self._render_event.set()
+
     def writereg(self, reg: int, value: int):
         # if reg in self.ignoreregs:
         #     return
@@ -135,7 +211,9 @@ class AdlibPlayer:
         self.writereg(reg, value)
         self._position += 1
         if ticks:
-            self._delay += (ticks * self._freq) // self.ticks_per_second
+            # Keep the remainder so that delays don't drift from the song timing.
+            delay, self._delay_remainder = divmod(ticks * self._freq + self._delay_remainder, self.ticks_per_second)
+            self._delay += delay
 
     @property
     def state(self):
@@ -155,24 +233,102 @@ class AdlibPlayer:
             # Consider it stopped here.
             return PlayerState.STOPPED
 
+    def _render_buffer(self, index: int) -> int:
+        """Fills a buffer with the song's samples, rendering only the samples between commands so that commands take
+        effect at the exact sample their delay calls for.
+
+        If the song ends before the buffer is full, the rest of it is filled with the synth's output anyway.
+
+        :param index: The buffer index.
+        :return: The number of samples rendered before the song ended.  The buffer sample count if it didn't end.
+        """
+        frame_size = AdlibPlayer.SAMPLE_SIZE * AdlibPlayer.CHANNELS
+        view = self._views[index]
+        buffer_position = 0  # In samples.
+        while buffer_position < AdlibPlayer.BUFFER_SAMPLE_COUNT:
+            # The delay is negative when more samples than it called for had to be rendered.
+            while self._delay <= 0 and self._position < self._song.command_count:
+                self._process_command()
+                if self.repeat and self._position == self._song.command_count:
+                    self._position = 0
+            if self._delay <= 0:
+                # The song has ended.
+                break
+            space = AdlibPlayer.BUFFER_SAMPLE_COUNT - buffer_position
+            count = max(min(self._delay, space), AdlibPlayer._MINIMUM_SAMPLE_COUNT)
+            # Don't leave less than the minimum at the end of the buffer.
+            if space - count == 1:
+                count += 1 if count == AdlibPlayer._MINIMUM_SAMPLE_COUNT else -1
+            self._opl.getSamples(view[buffer_position * frame_size:(buffer_position + count) * frame_size])
+            buffer_position += count
+            self._delay -= count
+        if 0 < buffer_position < AdlibPlayer.BUFFER_SAMPLE_COUNT:
+            self._opl.getSamples(view[buffer_position * frame_size:])
+        return buffer_position
+
     # noinspection PyUnusedLocal
     def _callback(self, input_data, frame_count, time_info, status):
-        # Build enough of a delay to fill the buffer.
-        while self._delay < AdlibPlayer.BUFFER_SAMPLE_COUNT and self._position < self._song.command_count:
-            self._process_command()
-            if self.repeat and self._position == self._song.command_count:
-                self._position = 0
-        # If we have enough to fill the buffer, do so. Otherwise quit.
-        if self._delay >= AdlibPlayer.BUFFER_SAMPLE_COUNT:
-            self._opl.getSamples(self._data)
-            self._delay -= AdlibPlayer.BUFFER_SAMPLE_COUNT
-            return self._buffer, pyaudio.paContinue
-        else:
-            self.rewind()
-            self.onstatechanged(state=PlayerState.STOPPED)
-            return None, pyaudio.paComplete
+        if self.lookahead:
+            return self._lookahead_callback()
+        # Use the next buffer in case PyAudio still holds the last one.
+        self._buffer_index = (self._buffer_index + 1) % len(self._buffers)
+        with self._synth_lock:
+            sample_count = self._render_buffer(self._buffer_index)
+            if sample_count < AdlibPlayer.BUFFER_SAMPLE_COUNT:
+                self._rewind()
+        buffer = self._buffers[self._buffer_index]
+        if sample_count == AdlibPlayer.BUFFER_SAMPLE_COUNT:
+            return buffer, pyaudio.paContinue
+        self.onstatechanged(state=PlayerState.STOPPED)
+        return (buffer if sample_count else None), pyaudio.paComplete
         # return self.buffer, pyaudio.paContinue if self.position < len(self.commands) else pyaudio.paComplete
 
+    def _lookahead_callback(self):
+        """Hands the next buffer rendered by the render thread to PyAudio."""
+        try:
+            index, sample_count = self._ready_buffers.popleft()
+        except IndexError:
+            self.underrun_count += 1
+            return self._silence, pyaudio.paContinue
+        # PyAudio is done with the last buffer now.
+        if self._played_buffer is not None:
+            self._free_buffers.append(self._played_buffer)
+        self._played_buffer = index
+        self._render_event.set()
+        if sample_count == AdlibPlayer.BUFFER_SAMPLE_COUNT:
+            return self._buffers[index], pyaudio.paContinue
+        self.onstatechanged(state=PlayerState.STOPPED)
+        return (self._buffers[index] if sample_count else None), pyaudio.paComplete
+
+    def _render_ahead(self):
+        """The render thread.  Renders buffers while there are free ones until the song ends or the player closes."""
+        while not self._closing:
+            self._render_event.wait()
+            # Clear before checking for free buffers so that a buffer freed after the check wakes the thread again.
+            self._render_event.clear()
+            while not self._closing and len(self._ready_buffers) < self.lookahead and self._render_next():
+                pass
+
+    def _render_next(self) -> bool:
+        """Renders the next buffer of the song into a free buffer and queues it for the callback.
+
+        :return: True if a buffer was rendered.  False if there were no free buffers or the song has ended.
+        """
+        with self._synth_lock:
+            if self._render_stopped:
+                return False
+            try:
+                index = self._free_buffers.popleft()
+            except IndexError:
+                return False
+            sample_count = self._render_buffer(index)
+            self._ready_buffers.append((index, sample_count))
+            if sample_count < AdlibPlayer.BUFFER_SAMPLE_COUNT:
+                # Stop at the end of the song.  Playing again resumes from the start.
+                self._rewind()
+                self._render_stopped = True
+            return True
+
     def play(self, repeat: bool = False):
         """Starts playing the song at the current position."""
         self.repeat = repeat
@@ -185,6 +341,16 @@ class AdlibPlayer:
         # If there's no stream at this point, create one.
         if self._stream is None:
             self._create_stream(False)
+        if self.lookahead:
+            self._render_stopped = False
+            if self._render_thread is None:
+                self._render_thread = threading.Thread(target=self._render_ahead, name="AdlibPlayer render",
+                                                       daemon=True)
+                self._render_thread.start()
+            # Render the first buffer now so that playback doesn't start with an underrun.
+            if not self._ready_buffers:
+                self._render_next()
+            self._render_event.set()
         self._stream.start_stream()
         # self._stream = self._create_stream()
         self.onstatechanged(state=PlayerState.PLAYING)
@@ -208,4 +374,9 @@ class AdlibPlayer:
             self._stream.stop_stream()
             self._stream.close()
             self._stream = None
+        if self._render_thread:
+            self._closing = True
+            self._render_event.set()
+            self._render_thread.join()
+            self._render_thread = None
         self._audio.terminate()
@@ -1,5 +1,7 @@
+import heapq as _heapq
 import importlib as _importlib
 import logging as _logging
+import operator as _operator
 import os as _os
 import typing as _typing
 import imfcreator.midi as _midi  # import SongEvent as _SongEvent
@@ -176,21 +178,27 @@ class InstrumentFile:
 class MidiSongFile:
     """The base class for 'input' song file types.
 
-    Implementing classes should populate `self.events` during `_load_file`.
+    Implementing classes should populate `self.events` during `_load_file`.  This is either a list or, when
+    `use_event_table` is set, a `SongEventTable`.
     """
 
     _FILETYPES = []  # type: _typing.List[_FileTypeEntry]
     PERCUSSION_CHANNEL = 9
     DEFAULT_PITCH_BEND_SCALE = 2.0
+    use_event_table = False
+    """When true, events are stored in a compact SongEventTable instead of a list of SongEvent objects."""
 
     def __init__(self, fp: _typing.IO, file: str):
-        self.events = []  # type: _typing.List[_midi.SongEvent]
+        self.events = _midi.SongEventTable() if self.use_event_table else []  # type: _typing.List[_midi.SongEvent]
+        self._sorted_events = None  # The events list when it was last sorted.
+        self._sorted_event_count = 0  # The length of the events list when it was last sorted.
         self.instruments = {}  # type: _typing.Dict[InstrumentId, _AdlibInstrument]
         self.title = None  # type: _typing.Optional[str]
         self.composer = None  # type: _typing.Optional[str]
         self.remarks = None  # type: _typing.Optional[str]
         self.file = file
         self.tics_per_second = 0
+        self.division = 1  # The number of event ticks per beat.  Set by _load_file.
         try:
             self.fp = fp
             self._load_file()
@@ -218,10 +226,35 @@ class MidiSongFile:
         raise NotImplementedError()
 
     def sort(self):
-        """Sorts the song events into chronological order.  Also reassigns event indices."""
-        self.events = sorted([_ for _ in self.events])  # type: _typing.List[_midi.SongEvent]
-        for index in range(len(self.events)):
-            self.events[index].index = index
+        """Sorts the song events into chronological order.  Also reassigns event indices.
+
+        Events are split into per-track runs, which song readers produce in chronological order, and the runs are
+        merged.  Sorting again does nothing unless the events list has been replaced or its length has changed.
+        """
+        if self._sorted_events is self.events and self._sorted_event_count == len(self.events):
+            return
+        if isinstance(self.events, _midi.SongEventTable):
+            self.events.sort()
+            self._set_sorted()
+            return
+        tracks = {}  # type: _typing.Dict[int, _typing.List[_midi.SongEvent]]
+        for song_event in self.events:
+            track_events = tracks.get(song_event.track)
+            if track_events is None:
+                track_events = tracks[song_event.track] = []
+            track_events.append(song_event)
+        # Sorting each run is close to linear since they are already in time order.  Only events that share a time
+        # need to be reordered.
+        sort_key = _operator.attrgetter("sort_key")
+        runs = [sorted(track_events, key=sort_key) for track_events in tracks.values()]
+        self.events = list(_heapq.merge(*runs, key=sort_key))  # type: _typing.List[_midi.SongEvent]
+        for index, song_event in enumerate(self.events):
+            song_event.index = index
+        self._set_sorted()
+
+    def _set_sorted(self):
+        self._sorted_events = self.events
+        self._sorted_event_count = len(self.events)
 
     @classmethod
     def load_file(cls, filename: str) -> "MidiSongFile":
@@ -298,12 +331,14 @@ class AdlibSongFile:
         raise NotImplementedError()
 
     @classmethod
-    def _convert_from(cls, midi_song: MidiSongFile, filetype: str, settings: _typing.Dict) -> "AdlibSongFile":
+    def _convert_from(cls, midi_song: MidiSongFile, filetype: str, settings: _typing.Dict,
+                      registry: "InstrumentRegistry") -> "AdlibSongFile":
         """Converts a MIDI song to bytes data for the given file type.
 
         :param midi_song: The MIDI song to convert from.
         :param filetype: The file type to convert the events to.
         :param settings: Any additional settings for the conversion.
+        :param registry: The instruments to convert with.
         :exception ValueError: When the given data is not valid.
         :return: A bytes object containing the converted song data.
         """
@@ -323,7 +358,7 @@ class AdlibSongFile:
 
     @classmethod
     def convert_from(cls, midi_song: MidiSongFile, filetype: str,
-                     settings: _typing.Dict = None) -> "AdlibSongFile":
+                     settings: _typing.Dict = None, registry: "InstrumentRegistry" = None) -> "AdlibSongFile":
         """Converts a MIDI song to bytes data for the given file type.
 
         Implementing classes muse override `_convert_from`.
@@ -331,6 +366,7 @@ class AdlibSongFile:
         :param midi_song: The MIDI song to convert from.
         :param filetype: The file type to convert the events to.
         :param settings: Any additional settings for the conversion.
+        :param registry: The instruments to convert with.  Defaults to `imfcreator.instruments.default_registry`.
         :exception ValueError: When the given data is not valid.
         :return: A bytes object containing the converted song data.
         """
@@ -341,7 +377,11 @@ class AdlibSongFile:
             if setting not in valid_settings:
                 raise ValueError(f"Unexpected setting: {setting}.  Valid settings are: {', '.join(valid_settings)}")
         # Validate settings.
-        return filetype_class._convert_from(midi_song, filetype, settings)
+        if registry is None:
+            # Imported here since the instruments module imports this one.
+            import imfcreator.instruments as instruments
+            registry = instruments.default_registry
+        return filetype_class._convert_from(midi_song, filetype, settings, registry)
 
     @classmethod
     def get_filetypes(cls) -> _typing.List["FileTypeInfo"]:
@@ -67,3 +67,20 @@ def read_midi_var_length(fp: _typing.IO):
         length = length * 0x80 + (b & 0x7f)
         b = u8(fp.read(1))
     return length * 0x80 + b
+
+
+def unpack_midi_var_length(data, offset: int = 0) -> _typing.Tuple[int, int]:
+    """Unpacks a length using MIDI's variable length format from a buffer.
+
+    :param data: A bytes-like object.
+    :param offset: The offset of the first byte of the length.
+    :return: The length and the offset of the byte following it.
+    """
+    length = 0
+    b = data[offset]
+    offset += 1
+    while b & 0x80:
+        length = length * 0x80 + (b & 0x7f)
+        b = data[offset]
+        offset += 1
+    return length * 0x80 + b, offset
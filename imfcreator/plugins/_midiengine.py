@@ -33,6 +33,43 @@ def _controller_handler(*controllers):
     return _decorator
 
 
+def _event_tuple_builder(event_class: type) -> _typing.Callable[[_midi.SongEvent], tuple]:
+    """Returns a function that creates an `event_class` tuple from a song event.
+
+    The tuple is built positionally from the song event fields followed by the remaining tuple fields from the event's
+    data dictionary.
+    """
+    make = event_class._make
+    if event_class._fields[4:5] == ("channel",):
+        data_keys = event_class._fields[5:]
+
+        def build(song_event: _midi.SongEvent) -> tuple:
+            data = song_event.data
+            return make((song_event.time, song_event.ticks, song_event.track, song_event.type, song_event.channel,
+                         *[data[key] for key in data_keys]))
+    else:
+        data_keys = event_class._fields[4:]
+
+        def build(song_event: _midi.SongEvent) -> tuple:
+            data = song_event.data
+            return make((song_event.time, song_event.ticks, song_event.track, song_event.type,
+                         *[data[key] for key in data_keys]))
+    return build
+
+
+def _signal_handler(signal: Signal, event_class: type) -> _typing.Optional[_typing.Callable[[_midi.SongEvent], None]]:
+    """Returns an event handler that triggers the signal with an `event_class` tuple, or None when the signal has no
+    listeners.
+    """
+    if not signal:
+        return None
+    build = _event_tuple_builder(event_class)
+
+    def handler(song_event: _midi.SongEvent):
+        signal(song_event=build(song_event))
+    return handler
+
+
 class MidiEngine:
     """A class to process song events in chronological order.
 
@@ -87,88 +124,140 @@ class MidiEngine:
     def is_percussion_channel(self, channel: int) -> bool:
         return channel == self._song.PERCUSSION_CHANNEL or self.channels[channel].bank in MidiEngine._DRUM_BANKS
 
+    def _compile_handlers(self) -> _typing.List[_typing.Optional[_typing.Callable[[_midi.SongEvent], None]]]:
+        """Builds the event handler table used by `start`, indexed by event type.
+
+        Meta events are dispatched through a second table indexed by meta type.  Event kinds whose signals have no
+        listeners and that don't change channel state have no handler, so they are skipped without building event
+        tuples.  Listeners added while the engine is running are not seen until the next run.
+        """
+        channels = self.channels
+
+        def unexpected_event(song_event: _midi.SongEvent):
+            _logging.error(f"Unexpected MIDI event type: {song_event.type}")
+
+        def unexpected_meta_event(song_event: _midi.SongEvent):
+            _logging.error(f"Unexpected meta event type: {song_event['meta_type']}")
+
+        handlers = [unexpected_event] * 256
+        # Note events.
+        on_note_off = self.on_note_off or None
+        on_note_on = self.on_note_on or None
+        build_note_event = _event_tuple_builder(NoteEvent)
+
+        def note_off(song_event: _midi.SongEvent):
+            on_note_off(song_event=build_note_event(song_event))
+
+        def note_on(song_event: _midi.SongEvent):
+            if song_event.data["velocity"] == 0:
+                if on_note_off:
+                    on_note_off(song_event=build_note_event(song_event))
+            elif on_note_on:
+                on_note_on(song_event=build_note_event(song_event))
+
+        handlers[_midi.EventType.NOTE_OFF] = note_off if on_note_off else None
+        handlers[_midi.EventType.NOTE_ON] = note_on if on_note_off or on_note_on else None
+        # Channel state events.  These always update the channel, but only build events when there are listeners.
+        on_controller_change = self.on_controller_change or None
+        build_controller_change_event = _event_tuple_builder(ControllerChangeEvent)
+        controller_types = _midi.CONTROLLER_TYPES
+
+        def controller_change(song_event: _midi.SongEvent):
+            data = song_event.data
+            channels[song_event.channel].set_controller_value(controller_types[data["controller"]], data["value"])
+            if on_controller_change:
+                on_controller_change(song_event=build_controller_change_event(song_event))
+
+        on_program_change = self.on_program_change or None
+        build_program_change_event = _event_tuple_builder(ProgramChangeEvent)
+
+        def program_change(song_event: _midi.SongEvent):
+            # Only trigger the signal if the value changes.
+            channel = channels[song_event.channel]
+            program = song_event.data["program"]
+            if channel.instrument != program:
+                channel.instrument = program
+                if on_program_change:
+                    on_program_change(song_event=build_program_change_event(song_event))
+
+        on_channel_key_pressure = self.on_channel_key_pressure or None
+        build_channel_key_pressure_event = _event_tuple_builder(ChannelKeyPressureEvent)
+
+        def channel_key_pressure(song_event: _midi.SongEvent):
+            # Only trigger the signal if the value changes.
+            channel = channels[song_event.channel]
+            pressure = song_event.data["pressure"]
+            if channel.key_pressure != pressure:
+                channel.key_pressure = pressure
+                if on_channel_key_pressure:
+                    on_channel_key_pressure(song_event=build_channel_key_pressure_event(song_event))
+
+        on_pitch_bend = self.on_pitch_bend or None
+        build_pitch_bend_event = _event_tuple_builder(PitchBendEvent)
+
+        def pitch_bend(song_event: _midi.SongEvent):
+            # Only trigger the signal if the value changes.
+            channel = channels[song_event.channel]
+            amount = song_event.data["amount"]
+            if channel.pitch_bend != amount:
+                channel.pitch_bend = amount
+                if on_pitch_bend:
+                    on_pitch_bend(song_event=build_pitch_bend_event(song_event))
+
+        handlers[_midi.EventType.CONTROLLER_CHANGE] = controller_change
+        handlers[_midi.EventType.PROGRAM_CHANGE] = program_change
+        handlers[_midi.EventType.CHANNEL_KEY_PRESSURE] = channel_key_pressure
+        handlers[_midi.EventType.PITCH_BEND] = pitch_bend
+        # Events that only trigger signals.
+        handlers[_midi.EventType.POLYPHONIC_KEY_PRESSURE] = _signal_handler(self.on_polyphonic_key_pressure,
+                                                                            PolyphonicKeyPressureEvent)
+        handlers[_midi.EventType.F0_SYSEX] = _signal_handler(self.on_sysex, SysexEvent)
+        handlers[_midi.EventType.F7_SYSEX] = handlers[_midi.EventType.F0_SYSEX]
+        # Meta events.
+        meta_handlers = [unexpected_meta_event] * 256
+        for meta_type, signal, event_class in [
+            (_midi.MetaType.SEQUENCE_NUMBER, self.on_meta_sequence_number, SequenceNumberMetaEvent),
+            (_midi.MetaType.TEXT_EVENT, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.COPYRIGHT, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.TRACK_NAME, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.INSTRUMENT_NAME, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.LYRIC, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.MARKER, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.CUE_POINT, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.PROGRAM_NAME, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.DEVICE_NAME, self.on_meta_text, TextMetaEvent),
+            (_midi.MetaType.CHANNEL_PREFIX, self.on_meta_channel_prefix, ChannelPrefixMetaEvent),
+            (_midi.MetaType.PORT, self.on_meta_port, PortMetaEvent),
+            (_midi.MetaType.END_OF_TRACK, self.on_end_of_track, EndOfTrackMetaEvent),
+            (_midi.MetaType.SET_TEMPO, self.on_tempo_change, TempoChangeMetaEvent),
+            (_midi.MetaType.SMPTE_OFFSET, self.on_smpte_offset, SmpteOffsetMetaEvent),
+            (_midi.MetaType.TIME_SIGNATURE, self.on_time_signature, TimeSignatureMetaEvent),
+            (_midi.MetaType.KEY_SIGNATURE, self.on_key_signature, KeySignatureMetaEvent),
+            (_midi.MetaType.SEQUENCER_SPECIFIC, self.on_sequencer_specific, SequencerSpecificMetaEvent),
+        ]:
+            meta_handlers[meta_type] = _signal_handler(signal, event_class)
+
+        def meta_event(song_event: _midi.SongEvent):
+            handler = meta_handlers[song_event.data["meta_type"]]
+            if handler is not None:
+                handler(song_event)
+
+        handlers[_midi.EventType.META] = meta_event if any(meta_handlers) else None
+        return handlers
+
     def start(self):
+        handlers = self._compile_handlers()
+        on_debug_event = self.on_debug_event or None
         for song_event in self._song.events:
-            self.on_debug_event(song_event=song_event)
-            # Build event args.
-            event_args = {
-                "time": song_event.time,
-                "track": song_event.track,
-                "type": song_event.type,
-            }
-            if song_event.channel is not None:
-                event_args["channel"] = song_event.channel
-            event_args.update(song_event.data)
-            # Fire events
-            if song_event.type == _midi.EventType.NOTE_OFF:
-                self.on_note_off(song_event=NoteEvent(**event_args))
-            elif song_event.type == _midi.EventType.NOTE_ON:
-                if song_event["velocity"] == 0:
-                    self.on_note_off(song_event=NoteEvent(**event_args))
-                else:
-                    self.on_note_on(song_event=NoteEvent(**event_args))
-            elif song_event.type == _midi.EventType.POLYPHONIC_KEY_PRESSURE:
-                self.on_polyphonic_key_pressure(song_event=PolyphonicKeyPressureEvent(**event_args))
-            elif song_event.type == _midi.EventType.CONTROLLER_CHANGE:
-                # PyCharm bug - https://youtrack.jetbrains.com/issue/PY-42287
-                # noinspection PyArgumentList
-                controller = _midi.ControllerType(song_event["controller"])  # type: _midi.ControllerType
-                value = song_event["value"]
-                self.channels[song_event.channel].set_controller_value(controller, value)
-                self.on_controller_change(song_event=ControllerChangeEvent(**event_args))
-            elif song_event.type == _midi.EventType.PROGRAM_CHANGE:
-                # Only trigger the signal if the value changes.
-                if self.channels[song_event.channel].instrument != song_event["program"]:
-                    self.channels[song_event.channel].instrument = song_event["program"]
-                    self.on_program_change(song_event=ProgramChangeEvent(**event_args))
-            elif song_event.type == _midi.EventType.CHANNEL_KEY_PRESSURE:
-                # Only trigger the signal if the value changes.
-                if self.channels[song_event.channel].key_pressure != song_event["pressure"]:
-                    self.channels[song_event.channel].key_pressure = song_event["pressure"]
-                    self.on_channel_key_pressure(song_event=ChannelKeyPressureEvent(**event_args))
-            elif song_event.type == _midi.EventType.PITCH_BEND:
-                # Only trigger the signal if the value changes.
-                if self.channels[song_event.channel].pitch_bend != song_event["amount"]:
-                    self.channels[song_event.channel].pitch_bend = song_event["amount"]
-                    self.on_pitch_bend(song_event=PitchBendEvent(**event_args))
-            elif song_event.type in [_midi.EventType.F0_SYSEX, _midi.EventType.F7_SYSEX]:
-                self.on_sysex(song_event=SysexEvent(**event_args))
-            elif song_event.type == _midi.EventType.META:
-                meta_type = song_event["meta_type"]
-                if meta_type == _midi.MetaType.SEQUENCE_NUMBER:
-                    self.on_meta_sequence_number(song_event=SequenceNumberMetaEvent(**event_args))
-                elif meta_type in [_midi.MetaType.TEXT_EVENT,
-                                   _midi.MetaType.COPYRIGHT,
-                                   _midi.MetaType.TRACK_NAME,
-                                   _midi.MetaType.INSTRUMENT_NAME,
-                                   _midi.MetaType.LYRIC,
-                                   _midi.MetaType.MARKER,
-                                   _midi.MetaType.CUE_POINT,
-                                   _midi.MetaType.PROGRAM_NAME,
-                                   _midi.MetaType.DEVICE_NAME]:
-                    self.on_meta_text(song_event=TextMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.CHANNEL_PREFIX:
-                    self.on_meta_channel_prefix(song_event=ChannelPrefixMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.PORT:
-                    self.on_meta_port(song_event=PortMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.END_OF_TRACK:
-                    self.on_end_of_track(song_event=EndOfTrackMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.SET_TEMPO:
-                    self.on_tempo_change(song_event=TempoChangeMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.SMPTE_OFFSET:
-                    self.on_smpte_offset(song_event=SmpteOffsetMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.TIME_SIGNATURE:
-                    self.on_time_signature(song_event=TimeSignatureMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.KEY_SIGNATURE:
-                    self.on_key_signature(song_event=KeySignatureMetaEvent(**event_args))
-                elif meta_type == _midi.MetaType.SEQUENCER_SPECIFIC:
-                    self.on_sequencer_specific(song_event=SequencerSpecificMetaEvent(**event_args))
-                else:
-                    _logging.error(f"Unexpected meta event type: {meta_type}")
-            else:
-                _logging.error(f"Unexpected MIDI event type: {song_event.type}")
-        last_event_time = max([event.time for event in self._song.events])
-        self.on_end_of_song(song_event=EndOfSongEvent(time=last_event_time))
+            if on_debug_event:
+                on_debug_event(song_event=song_event)
+            handler = handlers[song_event.type]
+            if handler is not None:
+                handler(song_event)
+        # Events are sorted, so the last one is the latest.
+        last_event = self._song.events[-1]
+        if self.on_end_of_song:
+            self.on_end_of_song(song_event=EndOfSongEvent(time=last_event.time, ticks=last_event.ticks))
 
 
 class MidiChannelInfo:
@@ -450,6 +539,7 @@ class MidiChannelInfo:
 
 class NoteEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -459,6 +549,7 @@ class NoteEvent(_typing.NamedTuple):
 
 class PolyphonicKeyPressureEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -468,6 +559,7 @@ class PolyphonicKeyPressureEvent(_typing.NamedTuple):
 
 class ControllerChangeEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -477,6 +569,7 @@ class ControllerChangeEvent(_typing.NamedTuple):
 
 class ProgramChangeEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -485,6 +578,7 @@ class ProgramChangeEvent(_typing.NamedTuple):
 
 class ChannelKeyPressureEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -493,6 +587,7 @@ class ChannelKeyPressureEvent(_typing.NamedTuple):
 
 class PitchBendEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     channel: int
@@ -501,6 +596,7 @@ class PitchBendEvent(_typing.NamedTuple):
 
 class SysexEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     data: bytes
@@ -508,6 +604,7 @@ class SysexEvent(_typing.NamedTuple):
 
 class SequenceNumberMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -516,6 +613,7 @@ class SequenceNumberMetaEvent(_typing.NamedTuple):
 
 class TextMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -524,6 +622,7 @@ class TextMetaEvent(_typing.NamedTuple):
 
 class ChannelPrefixMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -532,6 +631,7 @@ class ChannelPrefixMetaEvent(_typing.NamedTuple):
 
 class PortMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -540,6 +640,7 @@ class PortMetaEvent(_typing.NamedTuple):
 
 class EndOfTrackMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -547,6 +648,7 @@ class EndOfTrackMetaEvent(_typing.NamedTuple):
 
 class TempoChangeMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -555,6 +657,7 @@ class TempoChangeMetaEvent(_typing.NamedTuple):
 
 class SmpteOffsetMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -567,6 +670,7 @@ class SmpteOffsetMetaEvent(_typing.NamedTuple):
 
 class TimeSignatureMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -578,6 +682,7 @@ class TimeSignatureMetaEvent(_typing.NamedTuple):
 
 class KeySignatureMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -587,6 +692,7 @@ class KeySignatureMetaEvent(_typing.NamedTuple):
 
 class SequencerSpecificMetaEvent(_typing.NamedTuple):
     time: float
+    ticks: int
     track: int
     type: _midi.EventType
     meta_type: _midi.MetaType
@@ -595,3 +701,4 @@ class SequencerSpecificMetaEvent(_typing.NamedTuple):
 
 class EndOfSongEvent(_typing.NamedTuple):
     time: float
+    ticks: int
@@ -5,15 +5,21 @@ import imfcreator.midi as _midi
 class SongBuilder:
     """A class to help build event lists for MidiSongFile classes."""
 
-    def __init__(self, playback_rate: float, track: int = 0):
+    def __init__(self, playback_rate: int, track: int = 0,
+                 events: _typing.Union[_typing.List[_midi.SongEvent], _midi.SongEventTable] = None):
         """Starts the builder.
 
-        :param playback_rate: The playback rate for the events.  Event times are divided by this value.
+        :param playback_rate: The playback rate for the events, in ticks per beat.  This is the events' division.
         :param track: The track number for the generated event list.
+        :param events: An event list or SongEventTable to which events are added.  When not given, a new list is used.
         """
         self.track = track
         self.playback_rate = playback_rate
-        self._events = []  # type: _typing.List[_midi.SongEvent]
+        self._events = [] if events is None else events
+        self._table = events if isinstance(events, _midi.SongEventTable) else None
+        if self._table is not None:
+            self._table.division = playback_rate
+        self._event_count = 0
         self.current_time = 0
 
     def add_time(self, time: int):
@@ -21,12 +27,15 @@ class SongBuilder:
         self.current_time += time
 
     def add_event(self, event_type: _midi.EventType, data: dict = None, channel: int = None):
-        song_event = _midi.SongEvent(len(self._events), self.track, self.current_time / float(self.playback_rate),
-                                     event_type, data, channel)
-        self._events.append(song_event)
+        if self._table is not None:
+            self._table.add(self._event_count, self.track, self.current_time, event_type, data, channel)
+        else:
+            self._events.append(_midi.SongEvent(self._event_count, self.track, self.current_time, event_type, data,
+                                                channel, self.playback_rate))
+        self._event_count += 1
 
     @property
-    def events(self) -> _typing.List[_midi.SongEvent]:
+    def events(self) -> _typing.Union[_typing.List[_midi.SongEvent], _midi.SongEventTable]:
         return self._events
 
     def note_off(self, channel: int, note: int, velocity: int):
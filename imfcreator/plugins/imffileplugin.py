@@ -1,3 +1,5 @@
+import collections as _collections
+import functools as _functools
 import logging as _logging
 import math as _math
 import struct as _struct
@@ -10,6 +12,300 @@ from . import AdlibSongFile, FileTypeInfo, FileTypeSetting, InstrumentType, Midi
 from imfcreator.adlib import *
 
 
+# https://github.com/lantus/Strife/blob/master/i_oplmusic.c#L288
+# https://github.com/chocolate-doom/chocolate-doom/blob/master/src/i_oplmusic.c#L285
+_VOLUME_TABLE = [
+    0, 1, 3, 5, 6, 8, 10, 11,
+    13, 14, 16, 17, 19, 20, 22, 23,
+    25, 26, 27, 29, 30, 32, 33, 34,
+    36, 37, 39, 41, 43, 45, 47, 49,
+    50, 52, 54, 55, 57, 59, 60, 61,
+    63, 64, 66, 67, 68, 69, 71, 72,
+    73, 74, 75, 76, 77, 79, 80, 81,
+    82, 83, 84, 84, 85, 86, 87, 88,
+    89, 90, 91, 92, 92, 93, 94, 95,
+    96, 96, 97, 98, 99, 99, 100, 101,
+    101, 102, 103, 103, 104, 105, 105, 106,
+    107, 107, 108, 109, 109, 110, 110, 111,
+    112, 112, 113, 113, 114, 114, 115, 115,
+    116, 117, 117, 118, 118, 119, 119, 120,
+    120, 121, 121, 122, 122, 123, 123, 123,
+    124, 124, 125, 125, 126, 126, 127, 127
+]
+
+
+def _scale_operator_level(output_level: int, scale: int) -> int:
+    """Scales an operator output level (attenuation) by a value from 0 to 63."""
+    n = 0x3f - output_level
+    n = (n * scale) >> 6
+    return 0x3f - n
+
+
+def _get_brightness_scale(brightness_value: int) -> _typing.Optional[int]:
+    """Returns the operator scale for an XG brightness controller value or None when it is at full brightness."""
+    midi_brightness = 127 if brightness_value >= 64 else brightness_value * 2
+    if midi_brightness == 127:
+        return None
+    return int(round(127 * _math.sqrt(midi_brightness / 127.0)) // 2)
+
+
+# Operator output levels indexed by MIDI volume (0..127) then the instrument's operator output level (0..63).
+_OPERATOR_VOLUMES = [[_scale_operator_level(output_level, _VOLUME_TABLE[midi_volume] // 2)
+                      for output_level in range(64)]
+                     for midi_volume in range(128)]
+# Modulator output levels for FM instruments indexed by XG brightness controller value then output level.
+_OPERATOR_BRIGHTNESS = [[output_level if scale is None else _scale_operator_level(output_level, scale)
+                         for output_level in range(64)]
+                        for scale in map(_get_brightness_scale, range(128))]
+
+
+def _get_block_and_freq(note: int, scaled_pitch_bend: float) -> _typing.Tuple[int, int]:
+    """Calculates the block and f-num for a note and a pitch bend in semitones."""
+    assert note < 128
+    while note >= len(BLOCK_FREQ_NOTE_MAP):
+        note -= 12
+    block, freq = BLOCK_FREQ_NOTE_MAP[note]
+    if scaled_pitch_bend != 0:
+        # Adjust for pitch bend.
+        # The octave adjustment relies heavily on how the BLOCK_FREQ_NOTE_MAP has been calculated.
+        # F# is close to the top of the 1023 limit while G is in the middle at 517. Because of this,
+        # bends that cross over the line between F# and G are better handled in the range below G and the
+        # lower block/freq is adjusted upward so that it is in the same block as the other note.
+        # For each increment of 1 to the block, the f-num needs to be halved.  This can lead to a loss of
+        # precision, but hopefully it won't be too drastic.
+        rounding_function = _math.floor if scaled_pitch_bend < 0 else _math.ceil
+        semitones = int(rounding_function(scaled_pitch_bend))
+        bend_to_note = _utils.clamp(note + semitones, 0, len(BLOCK_FREQ_NOTE_MAP) - 1)
+        bend_block, bend_freq = BLOCK_FREQ_NOTE_MAP[bend_to_note]
+        # If the bend-to note is on a lower block/octave, multiply the *bend-to* f-num by 0.5 per block
+        # to bring it up to the same block as the original note.
+        # assert not (bend_block == 1 and block == 0 and note == 18 and semitones == -1)
+        if bend_block < block:
+            bend_freq /= (2.0 ** (block - bend_block))
+        # If the bend-to note is on a higher block/octave, multiply the *original* f-num by 0.5 per block
+        # to bring it up to the same block as the bend-to note.
+        if bend_block > block:
+            freq /= (2.0 ** (bend_block - block))
+            block = bend_block
+        freq = int(freq + (bend_freq - freq) * scaled_pitch_bend / semitones)
+    assert 0 <= block <= 7
+    assert 0 <= freq <= 0x3ff
+    return block, freq
+
+
+_get_cached_block_and_freq = _functools.lru_cache(maxsize=65536)(_get_block_and_freq)
+"""A memoized `_get_block_and_freq`.  Pitch bends come from 14-bit values, so most songs use few distinct bends."""
+
+
+# Registers whose writes act on bits that are set, so turning a bit off and back on at the same time still matters.
+# Values are the bit masks that trigger something when set: key on for channels and the percussion mode drums.
+_EDGE_TRIGGERED_BITS = {BLOCK_MSG | channel: KEY_ON_MASK for channel in range(OPL_CHANNELS)}
+_EDGE_TRIGGERED_BITS[DRUM_MSG] = PERCUSSION_MODE_BASS_DRUM_MASK | PERCUSSION_MODE_SNARE_DRUM_MASK | \
+    PERCUSSION_MODE_TOM_TOM_MASK | PERCUSSION_MODE_CYMBAL_MASK | PERCUSSION_MODE_HI_HAT_MASK
+# Writes to these are always kept.  Register 0 is used for padding and delays and the others are chip-wide controls.
+_UNOPTIMIZED_REGISTERS = frozenset([0, TEST_MSG, TIMER_1_COUNT_MSG, TIMER_2_COUNT_MSG, IRQ_RESET_MSG])
+
+
+# The order of register writes within a group of writes that happen at the same time.
+_KEY_OFF_ORDER = 0
+_INSTRUMENT_ORDER = 1
+_NOTE_ORDER = 2  # Volume and frequency.
+_KEY_ON_ORDER = 3
+_COMMAND_ORDERS = [_NOTE_ORDER if (reg & 0xe0) == VOLUME_MSG or (reg & 0xf0) == FREQ_MSG else _INSTRUMENT_ORDER
+                   for reg in range(256)]
+
+
+def _order_command_group(commands: _typing.List[_typing.Tuple[int, int, int]]) \
+        -> _typing.List[_typing.Tuple[int, int, int]]:
+    """Orders register writes that happen at the same time.
+
+    Key offs come first, then instrument settings, then volume and frequency, then key ons.  Writes are never moved
+    before an earlier write to the same register, so each register ends with the same value.
+
+    :param commands: The commands to order, as (register, value, delay) tuples.
+    :return: The ordered commands.
+    """
+    if len(commands) == 1:
+        return commands
+    groups = ([], [], [], [])
+    register_orders = {}
+    for command in commands:
+        reg, value, _ = command
+        edge_bits = _EDGE_TRIGGERED_BITS.get(reg)
+        if edge_bits is None:
+            order = _COMMAND_ORDERS[reg]
+        else:
+            order = _KEY_ON_ORDER if value & edge_bits else _KEY_OFF_ORDER
+        order = max(order, register_orders.get(reg, order))
+        register_orders[reg] = order
+        groups[order].append(command)
+    return groups[0] + groups[1] + groups[2] + groups[3]
+
+
+def _optimize_commands(commands: _typing.List[_typing.Tuple[int, int, int]]) \
+        -> _typing.List[_typing.Tuple[int, int, int]]:
+    """Removes IMF commands that don't change the sound of the song.
+
+    Commands are processed in groups of writes that happen at the same time, ie: each group ends with a command that has
+    a delay.  Within a group, only the last write to a register is kept unless an earlier write turns off a key on bit
+    that is on before the group and again at the end of it.  That key off is kept so the note is retriggered.  Writes
+    that set a register to the value it already has are removed.  Delays of removed commands are kept.
+
+    :param commands: The commands to optimize, as (register, value, delay) tuples.
+    :return: The optimized command list.
+    """
+    optimized = []
+    regs = [None] * 256  # type: _typing.List[_typing.Optional[int]]
+    group_start = 0
+    for group_end, (_, _, group_delay) in enumerate(commands):
+        if group_delay == 0 and group_end < len(commands) - 1:
+            continue
+        group = commands[group_start:group_end + 1]
+        group_start = group_end + 1
+        last_writes = {reg: index for index, (reg, _, _) in enumerate(group)}
+        group_commands = []
+        for index, (reg, value, _) in enumerate(group):
+            if reg in _UNOPTIMIZED_REGISTERS:
+                group_commands.append((reg, value, 0))
+                continue
+            last_write = last_writes[reg]
+            if index == last_write:
+                if regs[reg] == value:
+                    continue
+            else:
+                # Unknown register values might have the bits set.
+                current_value = 0xff if regs[reg] is None else regs[reg]
+                if not (~value & _EDGE_TRIGGERED_BITS.get(reg, 0) & group[last_write][1] & current_value):
+                    continue
+            regs[reg] = value
+            group_commands.append((reg, value, 0))
+        if group_commands:
+            group_commands[-1] = group_commands[-1][:2] + (group_delay,)
+            optimized.extend(group_commands)
+        elif group_delay:
+            # Every write in the group was removed.  Move its delay to the previous command.
+            if optimized and optimized[-1][2] + group_delay <= 0xffff:
+                optimized[-1] = optimized[-1][:2] + (optimized[-1][2] + group_delay,)
+            else:
+                optimized.append(group[-1])
+    return optimized
+
+
+_COMMAND_STRUCT = _struct.Struct("<BBH")  # reg, value, delay
+_DELAY_STRUCT = _struct.Struct("<H")
+
+
+class ImfCommands:
+    """A compact list of IMF commands.
+
+    Commands are stored in a bytearray as 4-byte IMF command records, the same format they are saved in.  Indexing and
+    iterating return (register, value, delay) tuples.  Commands can't be added while iterating.
+    """
+
+    def __init__(self, commands: _typing.Iterable[_typing.Tuple[int, int, int]] = None):
+        self.data = bytearray()
+        """The IMF command records."""
+        if commands is not None:
+            self.extend(commands)
+
+    def __len__(self):
+        return len(self.data) >> 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_command(i) for i in range(*index.indices(len(self)))]
+        return self._get_command(index)
+
+    def __iter__(self) -> _typing.Iterator[_typing.Tuple[int, int, int]]:
+        # The iterator holds a buffer export of the data, so adding commands while iterating raises BufferError.
+        return _COMMAND_STRUCT.iter_unpack(self.data)
+
+    def _get_offset(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ImfCommands index out of range")
+        return index * 4
+
+    def _get_command(self, index: int) -> _typing.Tuple[int, int, int]:
+        return _COMMAND_STRUCT.unpack_from(self.data, self._get_offset(index))
+
+    def append(self, reg: int, value: int, delay: int = 0):
+        """Adds a command."""
+        self.data += _COMMAND_STRUCT.pack(reg, value, delay)
+
+    def extend(self, commands: _typing.Iterable[_typing.Tuple[int, int, int]]):
+        """Adds (register, value, delay) commands."""
+        pack = _COMMAND_STRUCT.pack
+        self.data += b"".join([pack(*command) for command in commands])
+
+    def get_delay(self, index: int) -> int:
+        """Returns the delay of the command at the given index."""
+        return _DELAY_STRUCT.unpack_from(self.data, self._get_offset(index) + 2)[0]
+
+    def set_delay(self, index: int, delay: int):
+        """Sets the delay of the command at the given index in place."""
+        _DELAY_STRUCT.pack_into(self.data, self._get_offset(index) + 2, delay)
+
+
+class _ConversionDetail(_typing.NamedTuple):
+    """Settings that reduce the number of commands a conversion generates at the cost of detail."""
+    lookahead_allocation: bool = False
+    """When true, IMF channels are allocated with lookahead to reduce instrument changes.  See
+    `ImfSong.use_lookahead_allocation`.
+    """
+    pitch_bend_step: float = 0.0
+    """The smallest change in pitch bend, in semitones, that updates note frequencies.  Returning to center always
+    updates them.
+    """
+    volume_threshold: int = 0
+    """The smallest change in an operator's output level that controller volume updates write."""
+    controller_window: float = 0.0
+    """Controller volume updates for a MIDI channel within this many seconds of the last one are merged."""
+    note_volume_threshold: int = 0
+    """The smallest change in an operator's output level that note ons write."""
+    dropped_channel_count: int = 0
+    """The number of MIDI channels with the fewest notes whose notes are not converted.  At least one channel with
+    notes is always kept.  Only used when the `dropchannels` setting allows it.  See `ImfSong.dropchannels`.
+    """
+
+    @property
+    def description(self) -> str:
+        descriptions = []
+        if self.lookahead_allocation:
+            descriptions.append("lookahead channel allocation")
+        if self.pitch_bend_step:
+            descriptions.append(f"pitch bends in 1/{round(1 / self.pitch_bend_step)} semitone steps")
+        if self.volume_threshold:
+            descriptions.append(f"controller volume changes of {self.volume_threshold} or more")
+        if self.controller_window:
+            descriptions.append(f"controller volume updates merged within 1/{round(1 / self.controller_window)} "
+                                f"second")
+        if self.note_volume_threshold:
+            descriptions.append(f"note volume changes of {self.note_volume_threshold} or more")
+        if self.dropped_channel_count:
+            descriptions.append(f"{self.dropped_channel_count} least used MIDI channels dropped")
+        return ", ".join(descriptions) if descriptions else "full detail"
+
+
+# Conversion detail levels, from full detail to the least.  Used to fit songs in a command budget.  These only change
+# how the song is encoded.  Dropping channels is a separate setting.
+_DETAIL_LEVELS = [
+    _ConversionDetail(),
+    _ConversionDetail(lookahead_allocation=True),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 16),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 16, volume_threshold=2),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 8, volume_threshold=2,
+                      controller_window=1 / 40),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 4, volume_threshold=4,
+                      controller_window=1 / 20, note_volume_threshold=2),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 2, volume_threshold=8,
+                      controller_window=1 / 10, note_volume_threshold=4),
+    _ConversionDetail(lookahead_allocation=True, pitch_bend_step=1 / 2, volume_threshold=8,
+                      controller_window=1 / 10, note_volume_threshold=8),
+]
+
+
 @plugin
 class ImfSong(AdlibSongFile):
     """Writes an IMF file.
@@ -26,6 +322,14 @@ class ImfSong(AdlibSongFile):
     Type 1 files can have some unofficial tags, which can be added via settings.
     """
     _MAXIMUM_COMMAND_COUNT = 65535 // 4
+    use_pitch_bend_cache = True
+    """When true, block and f-num calculations are memoized.  Set to False to calculate every pitch bend exactly."""
+    use_command_optimizer = True
+    """When true, converted songs are passed through `optimize_commands`."""
+    use_lookahead_allocation = False
+    """When true, the instruments of upcoming notes are found before converting and used to choose which idle IMF
+    channel to load a new instrument into.
+    """
     _TAG_BYTE = b"\x1a"
     _DEFAULT_TICKS = {
         "imf0": 560,
@@ -35,8 +339,13 @@ class ImfSong(AdlibSongFile):
     }
 
     def __init__(self, midi_song: MidiSongFile, filetype: str = "imf1", ticks: int = None, title: str = None,
-                 composer: str = None, remarks: str = None, program: str = None):
+                 composer: str = None, remarks: str = None, program: str = None, budget: int = None,
+                 dropchannels: int = None):
         super().__init__(midi_song, filetype)
+        if budget is not None and budget < 0:
+            raise ValueError("Invalid budget value.  Must be 0 or greater.")
+        if dropchannels is not None and dropchannels < 0:
+            raise ValueError("Invalid dropchannels value.  Must be 0 or greater.")
         self._ticks = None
         self.ticks = ticks if ticks else ImfSong._DEFAULT_TICKS[filetype]
         self.title = title
@@ -45,7 +354,19 @@ class ImfSong(AdlibSongFile):
         self.program = program if program else "PyImf" if (self.title or self.composer or self.remarks) else None
         if (self.title or self.composer or self.remarks or self.program) and filetype not in ["imf1"]:
             _logging.warning(f"The title, composer, remarks, and program settings are not used by type '{filetype}'.")
-        self._commands = []  # type: _typing.List[_typing.Tuple[int, int, int]]  # reg, value, delay
+        self.budget = ImfSong._MAXIMUM_COMMAND_COUNT if budget == 0 else budget
+        """When set, conversion reduces detail as needed to fit the song within this number of commands.  This is best
+        effort.  Songs that don't fit at the lowest detail level are converted at that level.
+        """
+        self.dropchannels = dropchannels
+        """The most MIDI channels that can be dropped when the song does not fit the budget at the lowest detail level.
+        The channels with the fewest notes are dropped first.
+        """
+        self.dropped_channels = frozenset()  # type: _typing.FrozenSet[int]
+        """The MIDI channels whose notes were not converted."""
+        self.detail = _DETAIL_LEVELS[0]  # type: _ConversionDetail
+        """The detail level the song was converted with."""
+        self._commands = ImfCommands()
 
     @property
     def ticks(self) -> int:
@@ -58,11 +379,27 @@ class ImfSong(AdlibSongFile):
             raise ValueError("Invalid ticks value.  Must be 280, 560, or 700.")
         self._ticks = value
 
+    @property
+    def commands(self) -> ImfCommands:
+        """The IMF commands.  These should not be changed."""
+        return self._commands
+
     @property
     def command_count(self):
         """Returns the number of commands."""
         return len(self._commands)
 
+    def optimize_commands(self) -> int:
+        """Removes commands that don't change the sound of the song.  See `_optimize_commands`.
+
+        :return: The number of commands that were removed.
+        """
+        command_count = len(self._commands)
+        self._commands = ImfCommands(_optimize_commands(list(self._commands)))
+        removed_count = command_count - len(self._commands)
+        _logging.info(f"Removed {removed_count} unnecessary commands.")
+        return removed_count
+
     @classmethod
     def _get_filetypes(cls) -> _typing.List[FileTypeInfo]:
         return [
@@ -86,6 +423,13 @@ class ImfSong(AdlibSongFile):
                 FileTypeSetting("remarks", "The song remarks.  Limited to 255 characters."),
                 FileTypeSetting("program", "The program used to make the song.  Limited to 8 characters.  "
                                            "Defaults to 'PyImf' if title, composer, or remarks are set."),
+                FileTypeSetting("budget", "Reduces detail as needed to try to fit the song within this number of "
+                                          "commands.  Pitch bend, controller, and note volume detail is "
+                                          "reduced.  Use 0 for the type 1 maximum of "
+                                          f"{cls._MAXIMUM_COMMAND_COUNT}.", {"type": int}),
+                FileTypeSetting("dropchannels", "Drops up to this many MIDI channels with the fewest notes when the "
+                                                "song does not fit the budget at the lowest detail level.",
+                                {"type": int}),
             ]
         return None
 
@@ -105,13 +449,13 @@ class ImfSong(AdlibSongFile):
         if self._filetype == "imf1":
             # IMF Type 1 is limited to a 2-byte unsigned data length.
             if command_count > ImfSong._MAXIMUM_COMMAND_COUNT:
-                _logging.warning(f"Truncating commands list for '{self._filetype}'.")
+                _logging.warning(f"Truncating commands list for '{self._filetype}'.  "
+                                 f"Converted with detail level: {self.detail.description}.")
                 command_count = ImfSong._MAXIMUM_COMMAND_COUNT
             fp.write(_struct.pack("<H", command_count * 4))
         # command_count = ImfSong._MAXIMUM_COMMAND_COUNT
         _logging.info(f"Writing {command_count} commands.")
-        for command in self._commands[0:command_count]:
-            fp.write(_struct.pack("<BBH", *command))
+        fp.write(memoryview(self._commands.data)[0:command_count * 4])
         # Add unofficial tag for type 1 files.
         if self._filetype == "imf1" and (self.title or self.composer or self.remarks or self.program):
             fp.write(ImfSong._TAG_BYTE)
@@ -129,49 +473,150 @@ class ImfSong(AdlibSongFile):
             fp.write(b"\x00")
 
     @classmethod
-    def _convert_from(cls, midi_song: MidiSongFile, filetype: str, settings: _typing.Dict) -> "ImfSong":
+    def _convert_from(cls, midi_song: MidiSongFile, filetype: str, settings: _typing.Dict,
+                      registry: instruments.InstrumentRegistry) -> "ImfSong":
+        note_on_instruments = None
+        channel_note_counts = None
+        song = None
+        full_command_count = 0
+        # Convert with less detail until the song fits the budget.
+        for detail in cls._get_budget_details(settings.get("dropchannels")):
+            if note_on_instruments is None and (cls.use_lookahead_allocation or detail.lookahead_allocation):
+                note_on_instruments = cls._get_note_on_instruments(midi_song, registry)
+            if channel_note_counts is None and detail.dropped_channel_count:
+                channel_note_counts = cls._get_channel_note_counts(midi_song)
+            song = cls._convert_with_detail(midi_song, filetype, settings, registry, detail, note_on_instruments,
+                                            cls._get_dropped_channels(channel_note_counts,
+                                                                      detail.dropped_channel_count))
+            if song.budget is None or song.command_count <= song.budget:
+                break
+            if not full_command_count:
+                full_command_count = song.command_count
+        if full_command_count:
+            _logging.warning(f"Reduced detail to fit the budget of {song.budget} commands: {song.detail.description}.  "
+                             f"Commands: {full_command_count} -> {song.command_count}")
+        if song.dropped_channels:
+            _logging.warning(f"Dropped MIDI channels to fit the budget: "
+                             f"{', '.join(str(channel) for channel in sorted(song.dropped_channels))}.")
+        if song.budget is not None and song.command_count > song.budget:
+            _logging.warning(f"The song does not fit the budget of {song.budget} commands at the lowest detail level.")
+        return song
+
+    @staticmethod
+    def _get_budget_details(dropchannels: _typing.Optional[int]) -> _typing.List[_ConversionDetail]:
+        """Returns the detail levels to try, in order, then the lowest level dropping up to the given channel count."""
+        return _DETAIL_LEVELS + [_DETAIL_LEVELS[-1]._replace(dropped_channel_count=count)
+                                 for count in range(1, (dropchannels or 0) + 1)]
+
+    @staticmethod
+    def _get_channel_note_counts(midi_song: MidiSongFile) -> _typing.Dict[int, int]:
+        """Returns the number of note ons in each MIDI channel that has notes."""
+        counts = _collections.Counter()
+        for song_event in midi_song.events:
+            if song_event.type == _midi.EventType.NOTE_ON and song_event.data["velocity"]:
+                counts[song_event.channel] += 1
+        return counts
+
+    @staticmethod
+    def _get_dropped_channels(channel_note_counts: _typing.Optional[_typing.Dict[int, int]],
+                              dropped_channel_count: int) -> _typing.FrozenSet[int]:
+        """Returns the MIDI channels with the fewest notes.  At least one channel with notes is kept."""
+        if not dropped_channel_count:
+            return frozenset()
+        channels = sorted(channel_note_counts, key=lambda channel: (channel_note_counts[channel], channel))
+        return frozenset(channels[:min(dropped_channel_count, len(channels) - 1)])
+
+    @staticmethod
+    def _get_note_on_instruments(midi_song: MidiSongFile, registry: instruments.InstrumentRegistry) \
+            -> _typing.List[_typing.Tuple[int, AdlibInstrument]]:
+        """Returns the MIDI channels and instruments of the song's note on events, in order.  Notes without an
+        instrument are skipped.
+        """
+        engine = _midiengine.MidiEngine(midi_song)
+        note_on_instruments = []
+
+        def on_note_on(song_event: _midiengine.NoteEvent):
+            instrument = _get_event_instrument(engine, registry, song_event.channel, song_event.note)
+            if instrument is not None:
+                note_on_instruments.append((song_event.channel, instrument))
+
+        engine.on_note_on.add_handler(on_note_on)
+        engine.start()
+        return note_on_instruments
+
+    @classmethod
+    def _convert_with_detail(cls, midi_song: MidiSongFile, filetype: str, settings: _typing.Dict,
+                             registry: instruments.InstrumentRegistry, detail: _ConversionDetail,
+                             note_on_instruments: _typing.List[_typing.Tuple[int, AdlibInstrument]] = None,
+                             dropped_channels: _typing.AbstractSet[int] = frozenset()) -> "ImfSong":
         # Load settings.
         song = cls(midi_song, filetype, **settings)
+        song.detail = detail
+        song.dropped_channels = frozenset(dropped_channels)
         # Set up variables.
         engine = _midiengine.MidiEngine(midi_song)
         imf_channels = [_ImfChannelInfo(ch) for ch in range(1, 9)]
+        allocator = _ImfChannelAllocator(imf_channels)
+        lookahead = _InstrumentLookahead([instrument for channel, instrument in note_on_instruments
+                                          if channel not in dropped_channels]) \
+            if cls.use_lookahead_allocation or detail.lookahead_allocation else None
+        get_block_and_freq = _get_cached_block_and_freq if cls.use_pitch_bend_cache else _get_block_and_freq
+        # Active notes by MIDI channel and given note, oldest first.
+        active_note_index = _collections.defaultdict(_collections.deque)
         regs = [None] * 256  # type: _typing.List[_typing.Optional[int]]
+        # Reduced detail variables.  See _ConversionDetail.
+        last_pitch_bends = [0.0] * 16  # The last pitch bend written for each MIDI channel.
+        pending_pitch_bends = set()  # MIDI channels with a skipped pitch bend.  Written at the channel's next note on.
+        last_volume_update_ticks = [None] * 16  # The IMF ticks of the last controller volume update per MIDI channel.
+        pending_volume_updates = {}  # type: _typing.Dict[int, int]  # MIDI channel, event ticks
+        controller_window = round(detail.controller_window * song.ticks)  # In IMF ticks.
+        last_command_event_ticks = 0  # The song ticks of the last added commands.
+        # Commands are collected for each event time and added to the song together.  See _order_command_group.
+        command_group = []  # type: _typing.List[_typing.Tuple[int, int, int]]
+        command_group_ticks = 0  # The song ticks of the commands in command_group.
 
         # Tempo/delay related variables and methods.
-        ticks_per_beat = 0
-        last_command_ticks = 0  # The ticks at which the last IMF command occurred.
-        tempo_start_time = 0.0  # The time, in beats, at which the last tempo change occurred.
-        tempo_start_ticks = 0  # The number of tics at which the last tempo change occurred.
+        # Event times are integer song ticks.  IMF ticks are calculated with integer math from the song's division and
+        # the tempo in microseconds per beat, so there is no rounding drift over long songs.
+        song_division = midi_song.division * 1000000  # Song ticks per beat times microseconds per second.
+        microseconds_per_beat = 0
+        last_command_ticks = 0  # The IMF ticks at which the last IMF command occurred.
+        tempo_start_event_ticks = 0  # The time, in song ticks, at which the last tempo change occurred.
+        tempo_start_ticks = 0  # The number of IMF ticks at which the last tempo change occurred.
 
         # Define helper functions.
-        def calculate_current_ticks(event_time: float):
-            return int(ticks_per_beat * (event_time - tempo_start_time)) + tempo_start_ticks
+        def calculate_current_ticks(event_ticks: int):
+            return ((event_ticks - tempo_start_event_ticks) * song.ticks * microseconds_per_beat // song_division
+                    + tempo_start_ticks)
 
-        def set_tempo(event_time: float, bpm: float):
-            nonlocal ticks_per_beat, tempo_start_time, tempo_start_ticks
+        def set_tempo(event_ticks: int, bpm: float):
+            nonlocal microseconds_per_beat, tempo_start_event_ticks, tempo_start_ticks
             # Calculate tempo_start_ticks based on given event time, not last_command_ticks!
             # Must be done before changing any other values.
-            tempo_start_ticks = calculate_current_ticks(event_time)
-            ticks_per_beat = song.ticks * (60.0 / bpm)
-            tempo_start_time = event_time
+            tempo_start_ticks = calculate_current_ticks(event_ticks)
+            microseconds_per_beat = round(60000000 / bpm)
+            tempo_start_event_ticks = event_ticks
 
         def on_tempo_change(song_event: _midiengine.TempoChangeMetaEvent):
-            set_tempo(song_event.time, song_event.bpm)
+            # Merged controller volume updates and the current command group must be timed with the tempo they were
+            # collected under.
+            for channel in list(pending_volume_updates):
+                flush_volume_updates(song_event.ticks, channel)
+            start_command_group(song_event.ticks)
+            set_tempo(song_event.ticks, song_event.bpm)
 
-        def add_delay(time: float, command_index: int):
+        def add_delay(event_ticks: int, command_index: int):
             nonlocal last_command_ticks, song
-            # To reduce rounding errors, calculate the ticks from the last tempo change and subtract the ticks at which
-            # the last command took place.
-            ticks = calculate_current_ticks(time)
-            # PyCharm has an incorrect warning here.
-            # noinspection PyTypeChecker
-            song._commands[command_index] = song._commands[command_index][:2] + (ticks - last_command_ticks,)
-            assert 0 <= song._commands[command_index][2] <= 0xffff, \
-                f"{time}, {tempo_start_time}, {ticks_per_beat}, {ticks}, {last_command_ticks}"
+            # Calculate the ticks from the last tempo change and subtract the ticks at which the last command took
+            # place.
+            ticks = calculate_current_ticks(event_ticks)
+            assert 0 <= ticks - last_command_ticks <= 0xffff, \
+                f"{event_ticks}, {tempo_start_event_ticks}, {microseconds_per_beat}, {ticks}, {last_command_ticks}"
+            song._commands.set_delay(command_index, ticks - last_command_ticks)
             last_command_ticks = ticks
 
         def add_command(reg: int, value: int, delay: int = 0):
-            """Adds a command to the song."""
+            """Adds a command to the current command group."""
             # if reg & VOLUME_MSG or reg & FREQ_MSG:
             #     value = value & 0xfe
             nonlocal regs
@@ -185,81 +630,78 @@ class ImfSong(AdlibSongFile):
                 _logging.error(f"Value out of range! 0x{reg:x}, 0x{value:x}, {delay}, cmd: {len(song._commands)}")
                 raise
             regs[reg] = value
-            song._commands.append((reg, value, delay))
+            command_group.append((reg, value, delay))
 
-        def add_commands(event_time: float, commands):
-            old_commands_length = len(song._commands)
+        def flush_command_group():
+            """Adds the current command group to the song and sets the delay before it."""
+            if command_group:
+                old_commands_length = len(song._commands)
+                song._commands.extend(_order_command_group(command_group))
+                add_delay(command_group_ticks, old_commands_length - 1)
+                command_group.clear()
+
+        def start_command_group(event_ticks: int):
+            """Flushes the current command group if it is for a different time than the given event ticks."""
+            nonlocal command_group_ticks
+            if event_ticks != command_group_ticks:
+                flush_command_group()
+                command_group_ticks = event_ticks
+
+        def add_commands(event_ticks: int, commands):
+            nonlocal last_command_event_ticks
+            start_command_group(event_ticks)
+            old_group_length = len(command_group)
             # Now add the new commands
             for command in commands:
                 add_command(*command)
-            if old_commands_length != len(song._commands):
-                add_delay(event_time, old_commands_length - 1)
+            if old_group_length != len(command_group):
+                last_command_event_ticks = event_ticks
+
+        def get_reload_score(channel: _ImfChannelInfo, instrument: AdlibInstrument):
+            """Scores loading the instrument into an idle channel.  Lower is better.
+
+            Replacing an instrument that is needed within the lookahead window is avoided most, then the number of
+            register writes, then replacing the instrument that is needed soonest.  Only voice 0 is written, so only
+            its registers are counted.
+            """
+            write_count = sum(1 for reg, value in instrument.get_instrument_regs(channel.number, 0)
+                              if regs[reg] != value)
+            if channel.instrument is None:
+                return False, write_count, 0
+            if allocator.count_instrument_channels(channel.instrument) > 1:
+                # Another channel keeps the instrument.
+                next_use = None
+            else:
+                next_use = lookahead.get_next_use(channel.instrument)
+            return (next_use is not None and next_use <= _LOOKAHEAD_NOTE_COUNT,
+                    write_count,
+                    0 if next_use is None else -next_use)
 
         # noinspection PyUnusedLocal
         def find_imf_channel(instrument: AdlibInstrument, note: int):
+            if lookahead:
+                lookahead.advance()
             # Find a channel that is set to the given instrument and is not currently playing a note.
-            channel = next(filter(lambda ch: ch.instrument == instrument and ch.last_note is None, imf_channels), None)
+            channel = allocator.find_free_channel_for_instrument(instrument)
             if channel:
                 return channel
-            # Find a channel that isn't playing a note that requires the least register changes.
-            # open_channels = [ch for ch in imf_channels if ch.last_note is None]
-            # if open_channels:
-            #     channel = min(open_channels,
-            #                   key=lambda ch: 0 if ch.instrument is None else
-            #                   instrument.compare_registers(ch.instrument))
+            # Find a channel that isn't playing a note that requires the least register changes and keeps the
+            # instruments of upcoming notes loaded.
+            if lookahead:
+                return min(allocator.get_free_channels(), key=lambda ch: get_reload_score(ch, instrument),
+                           default=None)
             # Find a channel that isn't playing a note.
-            channel = next(filter(lambda ch: ch.last_note is None, imf_channels), None)
+            channel = allocator.find_free_channel()
             if channel:
                 # print("OPEN", channel.instrument.compare_registers(instrument) if channel.instrument else "NONE")
                 return channel
             # TODO Aggressive channel find.
             return None
 
-        def find_imf_channel_for_instrument_note(instrument: AdlibInstrument, note: int):
-            return next(filter(lambda ch: ch.instrument == instrument and ch.last_note == note, imf_channels), None)
-
-        def get_block_and_freq(note: int, scaled_pitch_bend: float):
-            assert note < 128
-            while note >= len(BLOCK_FREQ_NOTE_MAP):
-                note -= 12
-            block, freq = BLOCK_FREQ_NOTE_MAP[note]
-            if scaled_pitch_bend != 0:
-                # Adjust for pitch bend.
-                # The octave adjustment relies heavily on how the BLOCK_FREQ_NOTE_MAP has been calculated.
-                # F# is close to the top of the 1023 limit while G is in the middle at 517. Because of this,
-                # bends that cross over the line between F# and G are better handled in the range below G and the
-                # lower block/freq is adjusted upward so that it is in the same block as the other note.
-                # For each increment of 1 to the block, the f-num needs to be halved.  This can lead to a loss of
-                # precision, but hopefully it won't be too drastic.
-                rounding_function = _math.floor if scaled_pitch_bend < 0 else _math.ceil
-                semitones = int(rounding_function(scaled_pitch_bend))
-                bend_to_note = _utils.clamp(note + semitones, 0, len(BLOCK_FREQ_NOTE_MAP) - 1)
-                bend_block, bend_freq = BLOCK_FREQ_NOTE_MAP[bend_to_note]
-                # If the bend-to note is on a lower block/octave, multiply the *bend-to* f-num by 0.5 per block
-                # to bring it up to the same block as the original note.
-                # assert not (bend_block == 1 and block == 0 and note == 18 and semitones == -1)
-                if bend_block < block:
-                    bend_freq /= (2.0 ** (block - bend_block))
-                # If the bend-to note is on a higher block/octave, multiply the *original* f-num by 0.5 per block
-                # to bring it up to the same block as the bend-to note.
-                if bend_block > block:
-                    freq /= (2.0 ** (bend_block - block))
-                    block = bend_block
-                freq = int(freq + (bend_freq - freq) * scaled_pitch_bend / semitones)
-            assert 0 <= block <= 7
-            assert 0 <= freq <= 0x3ff
-            return block, freq
+        find_imf_channel_for_instrument_note = allocator.find_playing_channel
 
         def get_event_instrument(channel: int, note: int = 0) -> AdlibInstrument:
-            midi_channel = engine.channels[channel]
-            bank = midi_channel.bank
-            if engine.is_percussion_channel(channel):
-                # _logging.debug(f"Searching for PERCUSSION instrument {event['note']}")
-                return instruments.get(InstrumentType.PERCUSSION, midi_channel.instrument, note)
-            else:
-                inst_num = midi_channel.instrument
-                # _logging.debug(f"Searching for MELODIC instrument {inst_num}")
-                return instruments.get(InstrumentType.MELODIC, bank, inst_num)
+            return _get_event_instrument(engine, registry, channel, note)
 
         def get_instrument_note(instrument: AdlibInstrument, note: int, voice: int = 0):
             if instrument.use_given_note:
@@ -272,49 +714,17 @@ class ImfSong(AdlibSongFile):
 
         def get_volume_commands(imf_channel: _ImfChannelInfo, instrument: AdlibInstrument,
                                 midi_channel: _midiengine.MidiChannelInfo, note_velocity: int, voice: int = 0):
-            # https://github.com/lantus/Strife/blob/master/i_oplmusic.c#L288
-            # https://github.com/chocolate-doom/chocolate-doom/blob/master/src/i_oplmusic.c#L285
-            volume_table = [
-                0, 1, 3, 5, 6, 8, 10, 11,
-                13, 14, 16, 17, 19, 20, 22, 23,
-                25, 26, 27, 29, 30, 32, 33, 34,
-                36, 37, 39, 41, 43, 45, 47, 49,
-                50, 52, 54, 55, 57, 59, 60, 61,
-                63, 64, 66, 67, 68, 69, 71, 72,
-                73, 74, 75, 76, 77, 79, 80, 81,
-                82, 83, 84, 84, 85, 86, 87, 88,
-                89, 90, 91, 92, 92, 93, 94, 95,
-                96, 96, 97, 98, 99, 99, 100, 101,
-                101, 102, 103, 103, 104, 105, 105, 106,
-                107, 107, 108, 109, 109, 110, 110, 111,
-                112, 112, 113, 113, 114, 114, 115, 115,
-                116, 117, 117, 118, 118, 119, 119, 120,
-                120, 121, 121, 122, 122, 123, 123, 123,
-                124, 124, 125, 125, 126, 126, 127, 127
-            ]
             midi_volume = int(midi_channel.volume * midi_channel.expression * note_velocity)
-            midi_brightness = midi_channel.get_controller_value(_midi.ControllerType.XG_BRIGHTNESS)
-            midi_brightness = 127 if midi_brightness >= 64 else midi_brightness * 2
-
-            def get_operator_volume(op_volume):
-                n = 0x3f - (op_volume & 0x3f)
-                volume = volume_table[midi_volume] // 2
-                n = (n * volume) >> 6
-                return 0x3f - n
-
-            def get_operator_brightness(op_volume):
-                if midi_brightness == 127:
-                    return op_volume & 0x3f
-                n = 0x3f - (op_volume & 0x3f)
-                brightness = int(round(127 * _math.sqrt(midi_brightness / 127.0)) // 2)
-                n = (n * brightness) >> 6
-                return 0x3f - n
-
+            operator_volumes = _OPERATOR_VOLUMES[midi_volume]
+            modulator_level = instrument.modulator[voice].output_level
             # For AM, volume changes both modulator and carrier.
             # For FM, brightness changes modulator and volume only changes the carrier.
-            get_modulator_volume = get_operator_volume if instrument.feedback[voice] & 0x1 else get_operator_brightness
-            modulator_volume = get_modulator_volume(instrument.modulator[voice].output_level)
-            carrier_volume = get_operator_volume(instrument.carrier[voice].output_level)
+            if instrument.feedback[voice] & 0x1:
+                modulator_volume = operator_volumes[modulator_level]
+            else:
+                midi_brightness = midi_channel.get_controller_value(_midi.ControllerType.XG_BRIGHTNESS)
+                modulator_volume = _OPERATOR_BRIGHTNESS[midi_brightness][modulator_level]
+            carrier_volume = operator_volumes[instrument.carrier[voice].output_level]
             return [
                 (
                     VOLUME_MSG | MODULATORS[imf_channel.number],
@@ -326,7 +736,47 @@ class ImfSong(AdlibSongFile):
                 ),
             ]
 
+        def update_volumes(channel: int, event_ticks: int):
+            """Writes the volume of the active notes on a MIDI channel."""
+            midi_channel = engine.channels[channel]
+            if midi_channel.active_notes:
+                commands = []
+                instrument = get_event_instrument(channel)
+                for active_note in midi_channel.active_notes:
+                    imf_channel = find_imf_channel_for_instrument_note(instrument, active_note.adjusted_note)
+                    if imf_channel:
+                        commands += get_volume_commands(imf_channel, instrument, midi_channel, active_note.velocity)
+                if detail.volume_threshold:
+                    commands = skip_small_volume_changes(commands, detail.volume_threshold)
+                add_commands(event_ticks, commands)
+
+        def skip_small_volume_changes(commands, threshold: int):
+            """Removes volume commands that change an operator's output level by less than the threshold.  Silencing an
+            operator is always allowed.
+            """
+            return [(reg, value) for reg, value in commands
+                    if regs[reg] is None or (value & 0x3f) == 0x3f
+                    or abs((regs[reg] & 0x3f) - (value & 0x3f)) >= threshold]
+
+        def flush_volume_updates(event_ticks: int, channel: int = None):
+            """Writes merged controller volume updates whose window has passed or that are for the given channel."""
+            for pending_channel, pending_event_ticks in list(pending_volume_updates.items()):
+                if pending_channel == channel or (calculate_current_ticks(event_ticks)
+                                                  - last_volume_update_ticks[pending_channel]
+                                                  >= controller_window):
+                    del pending_volume_updates[pending_channel]
+                    last_volume_update_ticks[pending_channel] = calculate_current_ticks(event_ticks)
+                    # Never write before the current command group.
+                    update_volumes(pending_channel,
+                                   max(pending_event_ticks, last_command_event_ticks, command_group_ticks))
+
         def on_note_on(song_event: _midiengine.NoteEvent):
+            if song_event.channel in dropped_channels:
+                return
+            if pending_volume_updates:
+                flush_volume_updates(song_event.ticks, song_event.channel)
+            if song_event.channel in pending_pitch_bends:
+                update_pitch_bend(song_event.channel, song_event.ticks)
             instrument = get_event_instrument(song_event.channel, song_event.note)
             if instrument is None:
                 return
@@ -335,34 +785,42 @@ class ImfSong(AdlibSongFile):
             adjusted_note = get_instrument_note(instrument, song_event.note, voice)
             if not engine.is_percussion_channel(song_event.channel):
                 # _logging.debug(f"Adding active note: {event['note']} -> {note}, channel {event.channel}")
-                midi_channel.active_notes.append(_midiengine.ActiveNote(song_event.note, song_event.velocity,
-                                                                        adjusted_note))
+                active_note = _midiengine.ActiveNote(song_event.note, song_event.velocity, adjusted_note)
+                midi_channel.active_notes.append(active_note)
+                active_note_index[(song_event.channel, song_event.note)].append(active_note)
             imf_channel = find_imf_channel(instrument, adjusted_note)
             if imf_channel:
                 commands = []
                 # Check for instrument change.
                 if imf_channel.instrument != instrument:
                     # Removed volume messages. Volume will initialize to OFF.
-                    commands += [cmd for cmd in instrument.get_regs(imf_channel.number, voice) if
-                                 (cmd[0] & 0xf0) != VOLUME_MSG]
+                    commands += instrument.get_instrument_regs(imf_channel.number, voice)
                     # commands += [
                     #     (VOLUME_MSG | MODULATORS[channel.number], 0x3f),
                     #     (VOLUME_MSG | CARRIERS[channel.number], 0x3f),
                     # ]
-                    imf_channel.instrument = instrument
-                imf_channel.last_note = adjusted_note
+                    allocator.set_instrument(imf_channel, instrument)
+                allocator.set_note(imf_channel, adjusted_note)
                 block, freq = get_block_and_freq(adjusted_note, midi_channel.scaled_pitch_bend)
-                commands += get_volume_commands(imf_channel, instrument, midi_channel, song_event.velocity)
+                volume_commands = get_volume_commands(imf_channel, instrument, midi_channel, song_event.velocity)
+                if detail.note_volume_threshold and not commands:
+                    # Only when the instrument was already loaded, since the previous note's volume is still set.
+                    volume_commands = skip_small_volume_changes(volume_commands, detail.note_volume_threshold)
+                commands += volume_commands
                 commands += [
                     (FREQ_MSG | imf_channel.number, freq & 0xff),
                     (BLOCK_MSG | imf_channel.number, KEY_ON_MASK | (block << 2) | (freq >> 8)),
                 ]
-                add_commands(song_event.time, commands)
+                add_commands(song_event.ticks, commands)
                 # else:
             #     print(f"Could not find channel for note on! inst: {inst_num}, note: {note}")
             # return commands
 
         def on_note_off(song_event: _midiengine.NoteEvent):
+            if song_event.channel in dropped_channels:
+                return
+            if pending_volume_updates:
+                flush_volume_updates(song_event.ticks, song_event.channel)
             instrument = get_event_instrument(song_event.channel, song_event.note)
             if instrument is None:
                 return
@@ -370,8 +828,8 @@ class ImfSong(AdlibSongFile):
             adjusted_note = get_instrument_note(instrument, song_event.note, voice)
             if not engine.is_percussion_channel(song_event.channel):
                 midi_channel = engine.channels[song_event.channel]
-                match = next(filter(lambda note_info: note_info.given_note == song_event.note,
-                                    midi_channel.active_notes), None)  # type: _midiengine.ActiveNote
+                matches = active_note_index.get((song_event.channel, song_event.note))
+                match = matches.popleft() if matches else None  # type: _midiengine.ActiveNote
                 if match:
                     adjusted_note = match.adjusted_note
                     midi_channel.active_notes.remove(match)
@@ -379,33 +837,49 @@ class ImfSong(AdlibSongFile):
                     _logging.error(f"Tried to remove non-active note: track {song_event.track}, note {adjusted_note}")
             imf_channel = find_imf_channel_for_instrument_note(instrument, adjusted_note)
             if imf_channel:
-                imf_channel.last_note = None
-                add_commands(song_event.time, [
+                allocator.set_note(imf_channel, None)
+                add_commands(song_event.ticks, [
                     (BLOCK_MSG | imf_channel.number, regs[BLOCK_MSG | imf_channel.number] & ~KEY_ON_MASK),
                 ])
             # else:
             #     print(f"Could not find note to shut off! inst: {inst_num}, note: {note}")
 
         def on_pitch_bend(song_event: _midiengine.PitchBendEvent):
+            if pending_volume_updates:
+                flush_volume_updates(song_event.ticks)
             # Can't pitch bend percussion.
             if engine.is_percussion_channel(song_event.channel):
                 return
-            midi_channel = engine.channels[song_event.channel]
+            if detail.pitch_bend_step:
+                pitch_bend = engine.channels[song_event.channel].scaled_pitch_bend
+                if pitch_bend != 0 and abs(pitch_bend - last_pitch_bends[song_event.channel]) < detail.pitch_bend_step:
+                    # Keep the skipped pitch bend so that the channel doesn't stay off pitch if the bend settles here.
+                    pending_pitch_bends.add(song_event.channel)
+                    return
+            update_pitch_bend(song_event.channel, song_event.ticks)
+
+        def update_pitch_bend(channel: int, event_ticks: int):
+            """Writes the frequencies of the active notes on a MIDI channel for its current pitch bend."""
+            pending_pitch_bends.discard(channel)
+            midi_channel = engine.channels[channel]
             pitch_bend = midi_channel.scaled_pitch_bend
-            instrument = get_event_instrument(song_event.channel)  # midi_channels[event.channel]["instrument"]
+            last_pitch_bends[channel] = pitch_bend
+            instrument = get_event_instrument(channel)  # midi_channels[event.channel]["instrument"]
             for active_note in midi_channel.active_notes:
                 note = active_note.adjusted_note
                 imf_channel = find_imf_channel_for_instrument_note(instrument, note)
                 if imf_channel:
                     block, freq = get_block_and_freq(note, pitch_bend)
-                    add_commands(song_event.time, [
+                    add_commands(event_ticks, [
                         (FREQ_MSG | imf_channel.number, freq & 0xff),
                         (BLOCK_MSG | imf_channel.number, KEY_ON_MASK | (block << 2) | (freq >> 8)),
                     ])
                 else:
-                    _logging.warning(f"Could not find Adlib channel for channel {song_event.channel} note {note}.")
+                    _logging.warning(f"Could not find Adlib channel for channel {channel} note {note}.")
 
         def on_controller_change(song_event: _midiengine.ControllerChangeEvent):
+            if pending_volume_updates:
+                flush_volume_updates(song_event.ticks)
             if song_event.controller in (_midi.ControllerType.VOLUME_MSB,
                                          _midi.ControllerType.EXPRESSION_MSB,
                                          _midi.ControllerType.XG_BRIGHTNESS,
@@ -413,26 +887,28 @@ class ImfSong(AdlibSongFile):
                 # Can't adjust volume of active percussion.
                 if engine.is_percussion_channel(song_event.channel):
                     return
-                midi_channel = engine.channels[song_event.channel]
-                if midi_channel.active_notes:
-                    commands = []
-                    instrument = get_event_instrument(song_event.channel)
-                    for active_note in midi_channel.active_notes:
-                        imf_channel = find_imf_channel_for_instrument_note(instrument, active_note.adjusted_note)
-                        if imf_channel:
-                            commands += get_volume_commands(imf_channel, instrument, midi_channel, active_note.velocity)
-                    add_commands(song_event.time, commands)
+                if controller_window:
+                    ticks = calculate_current_ticks(song_event.ticks)
+                    last_ticks = last_volume_update_ticks[song_event.channel]
+                    if last_ticks is not None and ticks - last_ticks < controller_window:
+                        pending_volume_updates[song_event.channel] = song_event.ticks
+                        return
+                    last_volume_update_ticks[song_event.channel] = ticks
+                update_volumes(song_event.channel, song_event.ticks)
 
         def on_end_of_song(song_event: _midiengine.EndOfSongEvent):
-            add_delay(song_event.time, -1)
+            for channel in list(pending_volume_updates):
+                flush_volume_updates(song_event.ticks, channel)
+            flush_command_group()
+            add_delay(song_event.ticks, -1)
 
         # Set up the song and start the midi engine.
-        set_tempo(0.0, 120)  # Arbitrary default tempo if none is set by the song.
-        song._commands = [
+        set_tempo(0, 120)  # Arbitrary default tempo if none is set by the song.
+        song._commands = ImfCommands([
             (0, 0, 0),  # Always start with 0, 0, 0
             (0xBD, 0, 0),
             (0x8, 0, 0),
-        ]
+        ])
         engine.on_tempo_change.add_handler(on_tempo_change)
         engine.on_note_on.add_handler(on_note_on)
         engine.on_note_off.add_handler(on_note_off)
@@ -449,24 +925,130 @@ class ImfSong(AdlibSongFile):
                 _logging.warning(f"imf channel {ch.number} had open note: {ch.last_note}")
 
         # Remove commands that do nothing, ie: register value changes with no delay.
-        # temp_commands = []
-        # removed_commands = 0
-        # for index in range(len(song._commands)):
-        #     command = song._commands[index]
-        #     if command[2] == 0:
-        #         regs = [None] * 256
-        #     if regs[command[0]] is None:
-        #         regs[command[0]] = regs[command[1]]
-        #         temp_commands.append(command)
-        #     else:
-        #         removed_commands += 1
-        # _logging.debug(f"Removed {removed_commands} unnecessary commands.")
+        if cls.use_command_optimizer:
+            song.optimize_commands()
 
         return song
 
 
+def _get_event_instrument(engine: _midiengine.MidiEngine, registry: instruments.InstrumentRegistry, channel: int,
+                          note: int = 0) -> AdlibInstrument:
+    """Returns the instrument for a note on the given MIDI channel based on the engine's channel state."""
+    midi_channel = engine.channels[channel]
+    bank = midi_channel.bank
+    if engine.is_percussion_channel(channel):
+        # _logging.debug(f"Searching for PERCUSSION instrument {event['note']}")
+        return registry.get(InstrumentType.PERCUSSION, midi_channel.instrument, note)
+    else:
+        inst_num = midi_channel.instrument
+        # _logging.debug(f"Searching for MELODIC instrument {inst_num}")
+        return registry.get(InstrumentType.MELODIC, bank, inst_num)
+
+
+# The number of upcoming notes whose instruments lookahead allocation tries to keep loaded.  About one per channel.
+_LOOKAHEAD_NOTE_COUNT = 8
+
+
+class _InstrumentLookahead:
+    """Finds when instruments are next needed from the instruments of every note on in a song.
+
+    `advance` must be called once for each note on, in order.  Distances are measured in note ons.
+    """
+
+    def __init__(self, note_on_instruments: _typing.List[AdlibInstrument]):
+        self._note_ons = {}  # type: _typing.Dict[AdlibInstrument, _typing.Deque[int]]
+        for number, instrument in enumerate(note_on_instruments):
+            self._note_ons.setdefault(instrument, _collections.deque()).append(number)
+        self._position = -1
+
+    def advance(self):
+        """Moves to the next note on."""
+        self._position += 1
+
+    def get_next_use(self, instrument: AdlibInstrument) -> _typing.Optional[int]:
+        """Returns the number of note ons until the instrument is used again or None if it isn't used again."""
+        note_ons = self._note_ons.get(instrument)
+        if not note_ons:
+            return None
+        while note_ons and note_ons[0] <= self._position:
+            note_ons.popleft()
+        return note_ons[0] - self._position if note_ons else None
+
+
 class _ImfChannelInfo:
     def __init__(self, number):
         self.number = number
         self.instrument = None
         self.last_note = None
+
+
+class _ImfChannelAllocator:
+    """Indexes IMF channels by instrument and playing note so that channel lookups don't scan every channel.
+
+    Channel sets are stored as bit masks of positions in the channel list.  Lookups return the first matching channel
+    in list order, the same as a linear search would.  Channel instruments and notes must be changed through
+    `set_instrument` and `set_note` to keep the indices current.
+    """
+
+    def __init__(self, channels: _typing.List[_ImfChannelInfo]):
+        self.channels = channels
+        self._bits = {channel.number: 1 << position for position, channel in enumerate(channels)}
+        # Channel list positions by lowest set bit.
+        self._positions = {1 << position: position for position in range(len(channels))}
+        self._free = 0  # Channels that aren't playing a note.
+        self._by_instrument = {}  # type: _typing.Dict[AdlibInstrument, int]
+        self._by_instrument_note = {}  # type: _typing.Dict[_typing.Tuple[AdlibInstrument, int], int]
+        for channel in channels:
+            bit = self._bits[channel.number]
+            self._by_instrument[channel.instrument] = self._by_instrument.get(channel.instrument, 0) | bit
+            if channel.last_note is None:
+                self._free |= bit
+            else:
+                key = (channel.instrument, channel.last_note)
+                self._by_instrument_note[key] = self._by_instrument_note.get(key, 0) | bit
+
+    def _first(self, mask: int) -> _typing.Optional[_ImfChannelInfo]:
+        return self.channels[self._positions[mask & -mask]] if mask else None
+
+    def set_instrument(self, channel: _ImfChannelInfo, instrument: AdlibInstrument):
+        note = channel.last_note
+        self.set_note(channel, None)
+        bit = self._bits[channel.number]
+        self._by_instrument[channel.instrument] &= ~bit
+        channel.instrument = instrument
+        self._by_instrument[instrument] = self._by_instrument.get(instrument, 0) | bit
+        self.set_note(channel, note)
+
+    def set_note(self, channel: _ImfChannelInfo, note: _typing.Optional[int]):
+        bit = self._bits[channel.number]
+        by_instrument_note = self._by_instrument_note
+        if channel.last_note is None:
+            self._free &= ~bit
+        else:
+            by_instrument_note[(channel.instrument, channel.last_note)] &= ~bit
+        channel.last_note = note
+        if note is None:
+            self._free |= bit
+        else:
+            key = (channel.instrument, note)
+            by_instrument_note[key] = by_instrument_note.get(key, 0) | bit
+
+    def find_free_channel(self) -> _typing.Optional[_ImfChannelInfo]:
+        """Returns the first channel that isn't playing a note."""
+        return self._first(self._free)
+
+    def get_free_channels(self) -> _typing.List[_ImfChannelInfo]:
+        """Returns the channels that aren't playing a note, in list order."""
+        return [channel for channel in self.channels if self._free & self._bits[channel.number]]
+
+    def count_instrument_channels(self, instrument: AdlibInstrument) -> int:
+        """Returns the number of channels set to the given instrument."""
+        return bin(self._by_instrument.get(instrument, 0)).count("1")
+
+    def find_free_channel_for_instrument(self, instrument: AdlibInstrument) -> _typing.Optional[_ImfChannelInfo]:
+        """Returns the first channel set to the given instrument that isn't playing a note."""
+        return self._first(self._free & self._by_instrument.get(instrument, 0))
+
+    def find_playing_channel(self, instrument: AdlibInstrument, note: int) -> _typing.Optional[_ImfChannelInfo]:
+        """Returns the first channel playing the given note with the given instrument."""
+        return self._first(self._by_instrument_note.get((instrument, note), 0))
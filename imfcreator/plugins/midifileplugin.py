@@ -1,3 +1,5 @@
+import concurrent.futures as _futures
+import itertools as _itertools
 import logging as _logging
 import os as _os
 import struct as _struct
@@ -13,17 +15,16 @@ _TRACK_CHUNK_NAME = b"MTrk"
 _PERCUSSION_CHANNEL = 9
 
 
-def _u8(f):
-    """Read the next byte as an ordinal."""
-    return _binary.u8(f.read(1))
-
-
 @plugin
 class MidiFile(MidiSongFile):
     """Reads a MIDI file."""
 
+    parallel_workers = 0
+    """When greater than 1, the tracks of format 1 files are decoded in parallel using this many workers."""
+    parallel_executor = _futures.ProcessPoolExecutor
+    """The `concurrent.futures` executor class used when decoding tracks in parallel."""
+
     def __init__(self, fp=None, filename=None):
-        self._division = 0.0
         super().__init__(fp, filename)
 
     @classmethod
@@ -44,17 +45,35 @@ class MidiFile(MidiSongFile):
         if chunk_length != _HEADER_CHUNK_LENGTH:
             raise ValueError(f"Unexpected MIDI header chunk length: {chunk_length}")
         # Read header chunk data.
-        file_format, track_count, self._division = _struct.unpack(">HHH", self.fp.read(chunk_length))
+        file_format, track_count, self.division = _struct.unpack(">HHH", self.fp.read(chunk_length))
         if file_format not in (0, 1):
             raise ValueError(f"Unsupported MIDI file format: {file_format}")
-        # Process remaining chunks.
+        if isinstance(self.events, _midi.SongEventTable):
+            # Tracks decoded in parallel are merged into the table, which must use the file's division.
+            self.events.division = self.division
+        # Index the track chunks in a single pass, then decode them.
+        track_numbers = []  # type: _typing.List[int]
+        track_data = []  # type: _typing.List[bytes]
         for track_number in range(track_count):
             chunk_name, chunk_length = self._read_chunk_header()
             if chunk_name != _TRACK_CHUNK_NAME:
                 _logging.info(f"Skipping unrecognized chunk: {chunk_name}.")
                 self.fp.seek(chunk_length, _os.SEEK_CUR)
             else:
-                self._read_events(chunk_length, track_number)
+                data = self.fp.read(chunk_length)
+                if len(data) != chunk_length:
+                    raise ValueError(f"Unexpected end of file in track {track_number}.")
+                track_numbers.append(track_number)
+                track_data.append(data)
+        if file_format == 1 and self.parallel_workers > 1 and len(track_data) > 1:
+            # Tracks in format 1 files are independent of each other, so they can be decoded in parallel.
+            with self.parallel_executor(max_workers=self.parallel_workers) as executor:
+                for events in executor.map(_read_track_events, track_data, _itertools.repeat(self.division),
+                                           track_numbers):
+                    self.events.extend(events)
+        else:
+            for data, track_number in zip(track_data, track_numbers):
+                _read_track_events(data, self.division, track_number, self.events)
 
     def _read_chunk_header(self) -> (str, int):
         """Returns the chunk name and length at the current file position or None if at the end of the file."""
@@ -64,108 +83,219 @@ class MidiFile(MidiSongFile):
         chunk_length = _binary.u32be(self.fp.read(4))
         return chunk_name, chunk_length
 
-    def _read_events(self, chunk_length: int, track_number: int):
-        """Reads all of the events in a track chunk."""
-        builder = _SongBuilder(self._division, track_number)
-        running_status = None
-        chunk_end = self.fp.tell() + chunk_length
-        while self.fp.tell() < chunk_end:
-            # Read a MIDI event at the current file position.
-            builder.add_time(_binary.read_midi_var_length(self.fp))
-            # Read the event type.
-            event_type = _u8(self.fp)
-            # Check for running status.
-            if event_type & 0x80 == 0:
-                self.fp.seek(-1, _os.SEEK_CUR)
+
+def _read_track_events(data: bytes, division: int, track_number: int,
+                       events: _typing.Union[_typing.List[_midi.SongEvent], _midi.SongEventTable] = None):
+    """Reads all of the events in a track chunk.
+
+    The chunk data is decoded using an integer offset.  Each status byte is dispatched through the `_EVENT_READERS`
+    table.  This is a module-level function so that it can be run in a process pool.
+
+    :param data: The track chunk data.
+    :param division: The MIDI file's time division.
+    :param track_number: The track number for the events.
+    :param events: The event list or table to add the events to.  A new list is used when not given.
+    :return: The event list or table.
+    """
+    builder = _SongBuilder(division, track_number, events)
+    event_readers = _EVENT_READERS
+    unpack_var_length = _binary.unpack_midi_var_length
+    running_status = None
+    pos = 0
+    try:
+        while pos < len(data):
+            # Read a MIDI event at the current position.
+            delta_time, pos = unpack_var_length(data, pos)
+            builder.add_time(delta_time)
+            # Read the status byte and check for running status.
+            status = data[pos]
+            if status & 0x80 == 0:
                 if running_status is None:
-                    raise ValueError(f"Expected a running status, but it was None at pos {self.fp.tell()}.")
-                event_type = running_status
-            else:
-                # New status event. Clear the running status now.
-                # It will get reassigned later if necessary.
-                running_status = None
-            # Read event type data
-            if event_type in [_midi.EventType.F0_SYSEX, _midi.EventType.F7_SYSEX]:
-                data_length = _binary.read_midi_var_length(self.fp)
-                builder.add_sysex_data(event_type, self.fp.read(data_length))
-            elif event_type == _midi.EventType.META:
-                # PyCharm bug - https://youtrack.jetbrains.com/issue/PY-42287
-                # noinspection PyArgumentList
-                meta_type = _midi.MetaType(_u8(self.fp))
-                # event_data = {"meta_type": meta_type}
-                data_length = _binary.read_midi_var_length(self.fp)
-                if meta_type == _midi.MetaType.SEQUENCE_NUMBER:
-                    if data_length != 2:
-                        raise ValueError("MetaType.SEQUENCE_NUMBER events should have a data length of 2.")
-                    builder.add_meta_sequence_number(_binary.u16be(self.fp.read(2)))
-                elif meta_type in [_midi.MetaType.TEXT_EVENT,
-                                   _midi.MetaType.COPYRIGHT,
-                                   _midi.MetaType.TRACK_NAME,
-                                   _midi.MetaType.INSTRUMENT_NAME,
-                                   _midi.MetaType.LYRIC,
-                                   _midi.MetaType.MARKER,
-                                   _midi.MetaType.CUE_POINT,
-                                   _midi.MetaType.PROGRAM_NAME,
-                                   _midi.MetaType.DEVICE_NAME]:
-                    builder.add_meta_text_event(meta_type, self.fp.read(data_length))
-                elif meta_type == _midi.MetaType.CHANNEL_PREFIX:
-                    if data_length != 1:
-                        raise ValueError("MetaType.CHANNEL_PREFIX events should have a data length of 1.")
-                    builder.add_meta_channel_prefix(_u8(self.fp))
-                elif meta_type == _midi.MetaType.PORT:
-                    if data_length != 1:
-                        raise ValueError("MetaType.PORT events should have a data length of 1.")
-                    builder.add_meta_port(_u8(self.fp))
-                elif meta_type == _midi.MetaType.SET_TEMPO:
-                    if data_length != 3:
-                        raise ValueError("MetaType.SET_TEMPO events should have a data length of 3.")
-                    speed = (_u8(self.fp) << 16) + (_u8(self.fp) << 8) + _u8(self.fp)
-                    builder.set_tempo(60000000 / speed)  # 60 seconds as microseconds
-                elif meta_type == _midi.MetaType.SMPTE_OFFSET:
-                    if data_length != 5:
-                        raise ValueError("MetaType.SMPTE_OFFSET events should have a data length of 5.")
-                    builder.add_meta_smpte_offset(hours=_u8(self.fp),
-                                                  minutes=_u8(self.fp),
-                                                  seconds=_u8(self.fp),
-                                                  frames=_u8(self.fp),
-                                                  fractional_frames=_u8(self.fp))
-                elif meta_type == _midi.MetaType.TIME_SIGNATURE:
-                    if data_length != 4:
-                        raise ValueError("MetaType.TIME_SIGNATURE events should have a data length of 4.")
-                    builder.set_time_signature(numerator=_u8(self.fp),
-                                               denominator=2 ** _u8(self.fp),  # given in powers of 2.
-                                               midi_clocks_per_metronome_tick=_u8(self.fp),
-                                               number_of_32nd_notes_per_beat=_u8(self.fp))  # almost always 8
-                elif meta_type == _midi.MetaType.KEY_SIGNATURE:
-                    if data_length != 2:
-                        raise ValueError("MetaType.KEY_SIGNATURE events should have a data length of 2.")
-                    sharps_flats, major_minor = _struct.unpack("<bB", self.fp.read(2))
-                    builder.set_key_signature(sharps_flats, major_minor)
-                else:
-                    builder.add_meta_event(meta_type, {"data": self.fp.read(data_length)} if data_length else None)
+                    raise ValueError(f"Expected a running status, but it was None at pos {pos}.")
+                status = running_status
             else:
-                running_status = event_type
-                channel = event_type & 0xf
-                event_type &= 0xf0
-                if event_type == _midi.EventType.NOTE_OFF:
-                    builder.note_off(channel, note=_u8(self.fp), velocity=_u8(self.fp))
-                elif event_type == _midi.EventType.NOTE_ON:
-                    builder.note_on(channel, note=_u8(self.fp), velocity=_u8(self.fp))
-                elif event_type == _midi.EventType.POLYPHONIC_KEY_PRESSURE:
-                    builder.change_polyphonic_key_pressure(channel, note=_u8(self.fp), pressure=_u8(self.fp))
-                elif event_type == _midi.EventType.CONTROLLER_CHANGE:
-                    # PyCharm bug - https://youtrack.jetbrains.com/issue/PY-42287
-                    # noinspection PyArgumentList
-                    builder.change_controller(channel,
-                                              controller=_midi.ControllerType(_u8(self.fp)),
-                                              value=_u8(self.fp))
-                elif event_type == _midi.EventType.PROGRAM_CHANGE:
-                    builder.set_instrument(channel, program=_u8(self.fp))
-                elif event_type == _midi.EventType.CHANNEL_KEY_PRESSURE:
-                    builder.set_channel_key_pressure(channel, pressure=_u8(self.fp))
-                elif event_type == _midi.EventType.PITCH_BEND:
-                    value = (_u8(self.fp) + (_u8(self.fp) << 7))
-                    builder.pitch_bend(channel, amount=_midi.balance_14bit(value))
-                else:
-                    raise ValueError(f"Unsupported MIDI event code: 0x{event_type:x}")
-        self.events.extend(builder.events)
+                pos += 1
+                # Only channel messages can be continued with a running status.
+                running_status = status if status < _midi.EventType.F0_SYSEX else None
+            pos = event_readers[status](builder, data, pos, status)
+    except IndexError:
+        raise ValueError(f"Unexpected end of track chunk in track {track_number}.")
+    return builder.events
+
+
+# Event readers.  Each takes the builder, track data, position after the status byte, and the status byte, reads the
+# event data into the builder and returns the position after the event.
+def _read_note_off(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.note_off(status & 0xf, note=data[pos], velocity=data[pos + 1])
+    return pos + 2
+
+
+def _read_note_on(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.note_on(status & 0xf, note=data[pos], velocity=data[pos + 1])
+    return pos + 2
+
+
+def _read_polyphonic_key_pressure(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.change_polyphonic_key_pressure(status & 0xf, note=data[pos], pressure=data[pos + 1])
+    return pos + 2
+
+
+def _read_controller_change(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.change_controller(status & 0xf, controller=_midi.CONTROLLER_TYPES[data[pos]], value=data[pos + 1])
+    return pos + 2
+
+
+def _read_program_change(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.set_instrument(status & 0xf, program=data[pos])
+    return pos + 1
+
+
+def _read_channel_key_pressure(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.set_channel_key_pressure(status & 0xf, pressure=data[pos])
+    return pos + 1
+
+
+def _read_pitch_bend(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    builder.pitch_bend(status & 0xf, amount=_midi.balance_14bit(data[pos] + (data[pos + 1] << 7)))
+    return pos + 2
+
+
+def _read_sysex(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    data_length, pos = _binary.unpack_midi_var_length(data, pos)
+    builder.add_sysex_data(status, data[pos:pos + data_length])
+    return pos + data_length
+
+
+def _read_meta(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    meta_type = _midi.META_TYPES[data[pos]]
+    if meta_type is None:
+        raise ValueError(f"{data[pos]} is not a valid MetaType")
+    data_length, pos = _binary.unpack_midi_var_length(data, pos + 1)
+    _META_READERS[meta_type](builder, meta_type, data, pos, data_length)
+    return pos + data_length
+
+
+# noinspection PyUnusedLocal
+def _read_unsupported(builder: _SongBuilder, data: bytes, pos: int, status: int) -> int:
+    raise ValueError(f"Unsupported MIDI event code: 0x{status:x}")
+
+
+# Meta event readers.  Each takes the builder, meta type, track data, position of the meta data, and data length.
+# noinspection PyUnusedLocal
+def _read_meta_sequence_number(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int,
+                               data_length: int):
+    if data_length != 2:
+        raise ValueError("MetaType.SEQUENCE_NUMBER events should have a data length of 2.")
+    builder.add_meta_sequence_number((data[pos] << 8) + data[pos + 1])
+
+
+def _read_meta_text(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int, data_length: int):
+    builder.add_meta_text_event(meta_type, data[pos:pos + data_length])
+
+
+# noinspection PyUnusedLocal
+def _read_meta_channel_prefix(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int,
+                              data_length: int):
+    if data_length != 1:
+        raise ValueError("MetaType.CHANNEL_PREFIX events should have a data length of 1.")
+    builder.add_meta_channel_prefix(data[pos])
+
+
+# noinspection PyUnusedLocal
+def _read_meta_port(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int, data_length: int):
+    if data_length != 1:
+        raise ValueError("MetaType.PORT events should have a data length of 1.")
+    builder.add_meta_port(data[pos])
+
+
+# noinspection PyUnusedLocal
+def _read_meta_set_tempo(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int, data_length: int):
+    if data_length != 3:
+        raise ValueError("MetaType.SET_TEMPO events should have a data length of 3.")
+    speed = (data[pos] << 16) + (data[pos + 1] << 8) + data[pos + 2]
+    builder.set_tempo(60000000 / speed)  # 60 seconds as microseconds
+
+
+# noinspection PyUnusedLocal
+def _read_meta_smpte_offset(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int,
+                            data_length: int):
+    if data_length != 5:
+        raise ValueError("MetaType.SMPTE_OFFSET events should have a data length of 5.")
+    builder.add_meta_smpte_offset(hours=data[pos],
+                                  minutes=data[pos + 1],
+                                  seconds=data[pos + 2],
+                                  frames=data[pos + 3],
+                                  fractional_frames=data[pos + 4])
+
+
+# noinspection PyUnusedLocal
+def _read_meta_time_signature(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int,
+                              data_length: int):
+    if data_length != 4:
+        raise ValueError("MetaType.TIME_SIGNATURE events should have a data length of 4.")
+    builder.set_time_signature(numerator=data[pos],
+                               denominator=2 ** data[pos + 1],  # given in powers of 2.
+                               midi_clocks_per_metronome_tick=data[pos + 2],
+                               number_of_32nd_notes_per_beat=data[pos + 3])  # almost always 8
+
+
+# noinspection PyUnusedLocal
+def _read_meta_key_signature(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int,
+                             data_length: int):
+    if data_length != 2:
+        raise ValueError("MetaType.KEY_SIGNATURE events should have a data length of 2.")
+    sharps_flats, major_minor = _struct.unpack_from("<bB", data, pos)
+    builder.set_key_signature(sharps_flats, major_minor)
+
+
+def _read_meta_other(builder: _SongBuilder, meta_type: _midi.MetaType, data: bytes, pos: int, data_length: int):
+    builder.add_meta_event(meta_type, {"data": data[pos:pos + data_length]} if data_length else None)
+
+
+def _build_event_readers() -> _typing.List[_typing.Callable]:
+    """Returns a list of event readers indexed by status byte."""
+    readers = [_read_unsupported] * 256
+    channel_readers = {
+        _midi.EventType.NOTE_OFF: _read_note_off,
+        _midi.EventType.NOTE_ON: _read_note_on,
+        _midi.EventType.POLYPHONIC_KEY_PRESSURE: _read_polyphonic_key_pressure,
+        _midi.EventType.CONTROLLER_CHANGE: _read_controller_change,
+        _midi.EventType.PROGRAM_CHANGE: _read_program_change,
+        _midi.EventType.CHANNEL_KEY_PRESSURE: _read_channel_key_pressure,
+        _midi.EventType.PITCH_BEND: _read_pitch_bend,
+    }
+    for event_type, reader in channel_readers.items():
+        for channel in range(16):
+            readers[event_type | channel] = reader
+    readers[_midi.EventType.F0_SYSEX] = _read_sysex
+    readers[_midi.EventType.F7_SYSEX] = _read_sysex
+    readers[_midi.EventType.META] = _read_meta
+    return readers
+
+
+def _build_meta_readers() -> _typing.Dict[_midi.MetaType, _typing.Callable]:
+    """Returns a dictionary of meta event readers for every meta type."""
+    readers = {meta_type: _read_meta_other for meta_type in _midi.MetaType}
+    readers.update({
+        _midi.MetaType.SEQUENCE_NUMBER: _read_meta_sequence_number,
+        _midi.MetaType.TEXT_EVENT: _read_meta_text,
+        _midi.MetaType.COPYRIGHT: _read_meta_text,
+        _midi.MetaType.TRACK_NAME: _read_meta_text,
+        _midi.MetaType.INSTRUMENT_NAME: _read_meta_text,
+        _midi.MetaType.LYRIC: _read_meta_text,
+        _midi.MetaType.MARKER: _read_meta_text,
+        _midi.MetaType.CUE_POINT: _read_meta_text,
+        _midi.MetaType.PROGRAM_NAME: _read_meta_text,
+        _midi.MetaType.DEVICE_NAME: _read_meta_text,
+        _midi.MetaType.CHANNEL_PREFIX: _read_meta_channel_prefix,
+        _midi.MetaType.PORT: _read_meta_port,
+        _midi.MetaType.SET_TEMPO: _read_meta_set_tempo,
+        _midi.MetaType.SMPTE_OFFSET: _read_meta_smpte_offset,
+        _midi.MetaType.TIME_SIGNATURE: _read_meta_time_signature,
+        _midi.MetaType.KEY_SIGNATURE: _read_meta_key_signature,
+    })
+    return readers
+
+
+_EVENT_READERS = _build_event_readers()
+_META_READERS = _build_meta_readers()
@@ -42,11 +42,6 @@ class ControllerType(_IntEnum):
     SOFT_PEDAL = 9  # MIDI CC 67 - Soft pedal
 
 
-def _u8(f):
-    """Read the next byte as an ordinal."""
-    return _binary.u8(f.read(1))
-
-
 @plugin
 class MusFile(MidiSongFile):
     """Reads a MIDI file."""
@@ -54,7 +49,6 @@ class MusFile(MidiSongFile):
     PERCUSSION_CHANNEL = 15
 
     def __init__(self, fp=None, filename=None):
-        self._division = 0.0
         super().__init__(fp, filename)
 
     @classmethod
@@ -85,78 +79,130 @@ class MusFile(MidiSongFile):
         self._read_song_data(song_offset, song_length)
 
     def _read_song_data(self, song_offset: int, song_length: int):
-        """Reads all of the events in a track chunk."""
+        """Reads all of the events in the song data.
 
+        The song data is read into memory once and each event is dispatched through the `_EVENT_READERS` table.
+        """
         channel_volume = [127] * 16  # Start full volume.
-        playback_rate = 140.0  # TODO 70.0 for Raptor.
+        self.division = 140  # TODO 70 for Raptor.
 
-        builder = _SongBuilder(playback_rate)
+        builder = _SongBuilder(self.division, events=self.events)
         builder.set_tempo(60.0)
 
         self.fp.seek(song_offset)
-        song_end = song_offset + song_length
-        while self.fp.tell() < song_end:
-            data_byte = _u8(self.fp)
-            has_delay = (data_byte & 0x80)
-            event_type = (data_byte & 0x70) >> 4
-            channel = data_byte & 0x0f
-            # Process the event.
-            if event_type == EventType.RELEASE_NOTE:
-                note_number = _u8(self.fp)
-                builder.note_off(channel, note_number, 127)
-            elif event_type == EventType.PLAY_NOTE:
-                data_byte = _u8(self.fp)
-                note_number = data_byte & 0x7f
+        data = self.fp.read(song_length)
+        event_readers = _EVENT_READERS
+        pos = 0
+        try:
+            while pos < len(data):
+                data_byte = data[pos]
+                # Process the event.
+                pos = event_readers[(data_byte & 0x70) >> 4](builder, data, pos + 1, data_byte & 0x0f, channel_volume)
+                if pos is None:
+                    break
                 if data_byte & 0x80:
-                    channel_volume[channel] = _u8(self.fp)
-                builder.note_on(channel, note_number, channel_volume[channel])
-            elif event_type == EventType.PITCH_BEND:
-                amount = _binary.u8(self.fp.read(1)) - 0x80
-                amount = amount / (128.0 if amount < 0 else 127.0)
-                builder.pitch_bend(channel, amount)
-            elif event_type == EventType.SYSTEM:
-                system_controller = _u8(self.fp)
-                if system_controller == SystemEventType.ALL_SOUNDS_OFF:
-                    builder.change_controller(channel, _midi.ControllerType.ALL_SOUND_OFF, 0)
-                elif system_controller == SystemEventType.ALL_NOTES_OFF:
-                    builder.change_controller(channel, _midi.ControllerType.ALL_NOTES_OFF, 0)
-                elif system_controller == SystemEventType.MONO:
-                    builder.change_controller(channel, _midi.ControllerType.MONOPHONIC_MODE, 0)
-                elif system_controller == SystemEventType.POLY:
-                    builder.change_controller(channel, _midi.ControllerType.POLYPHONIC_MODE, 0)
-                elif system_controller == SystemEventType.RESET:
-                    builder.change_controller(channel, _midi.ControllerType.RESET_ALL_CONTROLLERS, 0)
-            elif event_type == EventType.CONTROLLER:
-                controller = _u8(self.fp)
-                value = _u8(self.fp)
-                if controller == ControllerType.CHANGE_INSTRUMENT:
-                    builder.set_instrument(channel, value)
-                elif controller == ControllerType.BANK_SELECT:
-                    builder.select_bank(channel, value)
-                elif controller == ControllerType.MODULATION:
-                    builder.set_modulation_wheel(channel, value)
-                elif controller == ControllerType.VOLUME:
-                    builder.set_volume(channel, value)
-                elif controller == ControllerType.PAN:
-                    builder.set_pan(channel, value)
-                elif controller == ControllerType.EXPRESSION:
-                    builder.set_expression(channel, value)
-                elif controller == ControllerType.REVERB_DEPTH:
-                    builder.change_controller(channel, _midi.ControllerType.REVERB_DEPTH, value)
-                elif controller == ControllerType.CHORUS_DEPTH:
-                    builder.change_controller(channel, _midi.ControllerType.CHORUS_DEPTH, value)
-                elif controller == ControllerType.SUSTAIN_PEDAL:
-                    builder.change_controller(channel, _midi.ControllerType.SUSTAIN_PEDAL_SWITCH, value)
-                elif controller == ControllerType.SOFT_PEDAL:
-                    builder.change_controller(channel, _midi.ControllerType.SOFT_PEDAL_SWITCH, value)
-            elif event_type == EventType.END_OF_MEASURE:
-                builder.add_marker("End of measure")
-                pass
-            elif event_type == EventType.FINISH:
-                builder.add_end_of_track()
-                break
-            elif event_type == EventType.UNUSED:
-                self.fp.read(1)
-            if has_delay:
-                builder.add_time(_binary.read_midi_var_length(self.fp))
-        self.events = builder.events
+                    delay, pos = _binary.unpack_midi_var_length(data, pos)
+                    builder.add_time(delay)
+        except IndexError:
+            raise ValueError("Unexpected end of song data.")
+
+
+# Event readers.  Each takes the builder, song data, position after the event byte, channel, and channel volume list,
+# reads the event data into the builder and returns the position after the event or None when the song is finished.
+# noinspection PyUnusedLocal
+def _read_release_note(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    builder.note_off(channel, data[pos], 127)
+    return pos + 1
+
+
+def _read_play_note(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    data_byte = data[pos]
+    pos += 1
+    if data_byte & 0x80:
+        channel_volume[channel] = data[pos]
+        pos += 1
+    builder.note_on(channel, data_byte & 0x7f, channel_volume[channel])
+    return pos
+
+
+# noinspection PyUnusedLocal
+def _read_pitch_bend(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    amount = data[pos] - 0x80
+    builder.pitch_bend(channel, amount / (128.0 if amount < 0 else 127.0))
+    return pos + 1
+
+
+# noinspection PyUnusedLocal
+def _read_system(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    controller = _SYSTEM_CONTROLLERS[data[pos]]
+    if controller is not None:
+        builder.change_controller(channel, controller, 0)
+    return pos + 1
+
+
+# noinspection PyUnusedLocal
+def _read_controller(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    controller = data[pos]
+    value = data[pos + 1]
+    if controller == ControllerType.CHANGE_INSTRUMENT:
+        builder.set_instrument(channel, value)
+    else:
+        midi_controller = _CONTROLLERS[controller]
+        if midi_controller is not None:
+            builder.change_controller(channel, midi_controller, value)
+    return pos + 2
+
+
+# noinspection PyUnusedLocal
+def _read_end_of_measure(builder: _SongBuilder, data: bytes, pos: int, channel: int,
+                         channel_volume: _typing.List[int]):
+    builder.add_marker("End of measure")
+    return pos
+
+
+# noinspection PyUnusedLocal
+def _read_finish(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    builder.add_end_of_track()
+    return None
+
+
+# noinspection PyUnusedLocal
+def _read_unused(builder: _SongBuilder, data: bytes, pos: int, channel: int, channel_volume: _typing.List[int]):
+    return pos + 1
+
+
+def _build_lookup(mapping: dict, size: int = 256) -> list:
+    """Returns a list of the mapping's values indexed by key.  Missing keys map to None."""
+    return [mapping.get(key) for key in range(size)]
+
+
+_EVENT_READERS = _build_lookup({
+    EventType.RELEASE_NOTE: _read_release_note,
+    EventType.PLAY_NOTE: _read_play_note,
+    EventType.PITCH_BEND: _read_pitch_bend,
+    EventType.SYSTEM: _read_system,
+    EventType.CONTROLLER: _read_controller,
+    EventType.END_OF_MEASURE: _read_end_of_measure,
+    EventType.FINISH: _read_finish,
+    EventType.UNUSED: _read_unused,
+}, 8)
+# MIDI controllers for MUS system events.
+_SYSTEM_CONTROLLERS = _build_lookup({
+    SystemEventType.ALL_SOUNDS_OFF: _midi.ControllerType.ALL_SOUND_OFF,
+    SystemEventType.ALL_NOTES_OFF: _midi.ControllerType.ALL_NOTES_OFF,
+    SystemEventType.MONO: _midi.ControllerType.MONOPHONIC_MODE,
+    SystemEventType.POLY: _midi.ControllerType.POLYPHONIC_MODE,
+    SystemEventType.RESET: _midi.ControllerType.RESET_ALL_CONTROLLERS,
+})
+# MIDI controllers for MUS controller events.  Instrument changes are handled separately.
+_CONTROLLERS = _build_lookup({
+    ControllerType.BANK_SELECT: _midi.ControllerType.BANK_SELECT_MSB,
+    ControllerType.MODULATION: _midi.ControllerType.MODULATION_WHEEL_MSB,
+    ControllerType.VOLUME: _midi.ControllerType.VOLUME_MSB,
+    ControllerType.PAN: _midi.ControllerType.PAN_MSB,
+    ControllerType.EXPRESSION: _midi.ControllerType.EXPRESSION_MSB,
+    ControllerType.REVERB_DEPTH: _midi.ControllerType.REVERB_DEPTH,
+    ControllerType.CHORUS_DEPTH: _midi.ControllerType.CHORUS_DEPTH,
+    ControllerType.SUSTAIN_PEDAL: _midi.ControllerType.SUSTAIN_PEDAL_SWITCH,
+    ControllerType.SOFT_PEDAL: _midi.ControllerType.SOFT_PEDAL_SWITCH,
+})
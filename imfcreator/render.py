@@ -0,0 +1,78 @@
+"""**Offline Renderer**
+
+Renders Adlib songs to PCM sample data or WAV files without an audio device.
+
+Songs are rendered as fast as the OPL emulator can generate samples, not in real time.
+"""
+import pyopl
+import typing as _typing
+import wave as _wave
+from imfcreator.adlib import RESET_REGISTERS
+
+FREQUENCY = 44100
+SAMPLE_SIZE = 2  # 16-bit
+CHANNELS = 2  # stereo
+_MINIMUM_SAMPLE_COUNT = 2  # The fewest samples pyopl generates per getSamples call.
+_MAXIMUM_SAMPLE_COUNT = 512  # The most samples pyopl generates per getSamples call.
+_BLOCK_SAMPLE_COUNT = 65536  # The number of samples in each block of rendered data.
+
+
+def render_samples(song, rate: int = FREQUENCY, channels: int = CHANNELS) -> _typing.Iterator[bytes]:
+    """Renders a song to 16-bit PCM sample data.
+
+    Sample positions are calculated from the total song ticks, so delays don't accumulate rounding errors.
+
+    :param song: The song to render.  It must have `ticks` and `commands`, like `ImfSong`.
+    :param rate: The sample rate.
+    :param channels: Channel count. 1 for mono, 2 for stereo.
+    :return: An iterator of sample data blocks.
+    """
+    opl = pyopl.opl(freq=rate, sampleSize=SAMPLE_SIZE, channels=channels)
+    for reg, value in RESET_REGISTERS:
+        opl.writeReg(reg, value)
+    frame_size = SAMPLE_SIZE * channels
+    # Blocks have room for one more call's worth of samples so that calls don't need to be split at the block's end.
+    block = bytearray((_BLOCK_SAMPLE_COUNT + _MAXIMUM_SAMPLE_COUNT) * frame_size)
+    view = memoryview(block)
+    block_position = 0  # In samples.
+    sample_count = 0  # The number of samples rendered.
+    song_ticks = 0
+    for reg, value, ticks in song.commands:
+        opl.writeReg(reg, value)
+        if not ticks:
+            continue
+        song_ticks += ticks
+        end_sample = song_ticks * rate // song.ticks
+        # When the minimum overshoots the end sample, the next delay is shortened to make up for it.
+        while sample_count < end_sample:
+            count = max(min(end_sample - sample_count, _MAXIMUM_SAMPLE_COUNT), _MINIMUM_SAMPLE_COUNT)
+            # Don't leave less than the minimum for the next call.
+            if end_sample - sample_count - count == 1:
+                count -= 1
+            opl.getSamples(view[block_position * frame_size:(block_position + count) * frame_size])
+            block_position += count
+            sample_count += count
+            if block_position >= _BLOCK_SAMPLE_COUNT:
+                yield bytes(view[0:block_position * frame_size])
+                block_position = 0
+    if block_position:
+        yield bytes(view[0:block_position * frame_size])
+
+
+def render(song, f=None, rate: int = FREQUENCY, channels: int = CHANNELS) -> _typing.Optional[bytes]:
+    """Renders a song to a WAV file or to 16-bit PCM sample data.
+
+    :param song: The song to render.  It must have `ticks` and `commands`, like `ImfSong`.
+    :param f: A filename or file object to write a WAV file to.  When None, the sample data is returned instead.
+    :param rate: The sample rate.
+    :param channels: Channel count. 1 for mono, 2 for stereo.
+    :return: The sample data when `f` is None; otherwise None.
+    """
+    if f is None:
+        return b"".join(render_samples(song, rate, channels))
+    with _wave.open(f, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(SAMPLE_SIZE)
+        wav.setframerate(rate)
+        for data in render_samples(song, rate, channels):
+            wav.writeframes(data)
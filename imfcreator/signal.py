@@ -6,12 +6,22 @@ class Signal:
     """A simple event system.
 
     Based on: https://stackoverflow.com/posts/35957226/revisions
+
+    Listener arguments are validated when a handler is added.  Triggering calls each listener without checking the
+    arguments again unless `validate_triggers` is set.  A signal is false when it has no listeners, so callers can skip
+    building event arguments that no one will receive.
     """
 
+    validate_triggers = False
+    """When true, trigger checks the given arguments against the signal's arguments on every call."""
+
     def __init__(self, **args):
         self._args = args
         self._arg_names = set(args.keys())
-        self._listeners = []
+        self._listeners = ()
+
+    def __bool__(self):
+        return bool(self._listeners)
 
     def _args_string(self):
         if len(self._arg_names) == 0:
@@ -24,13 +34,15 @@ class Signal:
             args.remove("self")
         if set(n for n in args) != self._arg_names:
             raise ValueError(f"Listener must have these arguments: {self._args_string()}")
-        self._listeners.append(listener)
+        self._listeners += (listener,)
 
     def remove_handler(self, listener):
-        self._listeners.remove(listener)
+        listeners = list(self._listeners)
+        listeners.remove(listener)
+        self._listeners = tuple(listeners)
 
     def trigger(self, *args, **kwargs):
-        if args or set(kwargs.keys()) != self._arg_names:
+        if self.validate_triggers and (args or set(kwargs.keys()) != self._arg_names):
             raise ValueError(f"Signal trigger must have these arguments: {self._args_string()}")
         for listener in self._listeners:
             listener(**kwargs)
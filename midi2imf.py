@@ -65,6 +65,7 @@ def main():
     import imfcreator.instruments as instruments
     from imfcreator.plugins import AdlibSongFile, MidiSongFile, load_plugins
     load_plugins()
+    from imfcreator.plugins.midifileplugin import MidiFile
     # noinspection PyTypeChecker
     parser = argparse.ArgumentParser(description="A tool to convert MIDI music files to IMF files.",
                                      formatter_class=HelpFormatter, parents=[logging_parser])
@@ -74,6 +75,12 @@ def main():
                         help="Sound banks to load.")
     parser.add_argument("-gm2", "--gm2drummapping", action="store_true",
                         help="Enables GM2 drum mapping when GM2 drum instruments are not defined in banks.")
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=0,
+                        help="Decodes the tracks of format 1 MIDI files in parallel using N processes.")
+    parser.add_argument("--wav", metavar="WAVFILE", type=str,
+                        help="Also renders the converted song to a WAV file.  Does not need an audio device.")
+    parser.add_argument("--rate", type=int, help="The sample rate of the WAV file.  Defaults to the renderer's "
+                                                 "sample rate.")
     # Add file types as subparsers
     subparsers = parser.add_subparsers(title="output file types", dest="type", metavar="filetype")
     for info in AdlibSongFile.get_filetypes():
@@ -86,14 +93,21 @@ def main():
     # parser.print_help()
     args = parser.parse_args()
     # print(args)
-    instruments.ENABLE_GM2_DRUM_NOTE_MAPPING = args.gm2drummapping
+    instruments.enable_gm2_drum_note_mapping = args.gm2drummapping
+    MidiFile.parallel_workers = args.jobs
     # Process args
     for bank in args.banks:
         instruments.add_file(bank)
-    settings = {}
+    settings = {setting.name: getattr(args, setting.name)
+                for setting in AdlibSongFile.get_filetype_settings(args.type)
+                if getattr(args, setting.name, None) is not None}
     midi_song = MidiSongFile.load_file(args.infile)
     adlib_song = AdlibSongFile.convert_from(midi_song, args.type, settings)
     adlib_song.save_file(args.outfile)
+    if args.wav:
+        import imfcreator.render as render
+        render.render(adlib_song, args.wav, render.FREQUENCY if args.rate is None else args.rate)
+        imfcreator.logging.info(f'Rendered song saved as "{args.wav}".')
 
 
 if __name__ == "__main__":